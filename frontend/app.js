@@ -992,7 +992,7 @@ class ChessApp {
                 this.animateMove(data.last_move.from, data.last_move.to);
                 // Update game state after animation
                 setTimeout(() => {
-                    this.gameState = data.game_state;
+                    this.applyMoveDelta(data);
                     this.updateValidMovesFromGameState();
                     this.renderChessBoard();
                     this.updateMoveHistory();
@@ -1006,7 +1006,7 @@ class ChessApp {
                 }, 300);
             } else {
                 // Update immediately without animation
-                this.gameState = data.game_state;
+                this.applyMoveDelta(data);
                 this.updateValidMovesFromGameState();
                 this.renderChessBoard();
                 this.updateMoveHistory();
@@ -1021,6 +1021,21 @@ class ChessApp {
         }
     }
 
+    applyMoveDelta(data) {
+        // move_made carries only what the move changed; without a delta it holds the whole game_state
+        if (!data.delta) {
+            this.gameState = data.game_state;
+            return;
+        }
+        const { squares, move, ply, ...fields } = data.delta;
+        squares.forEach(([row, col, piece]) => {
+            this.gameState.board[row][col] = piece;
+        });
+        // Indexed by ply so applying the same delta twice leaves one history entry
+        this.gameState.move_history[ply - 1] = move;
+        Object.assign(this.gameState, fields);
+    }
+
     handlePromotionPending(data) {
         this.gameState = data.game_state;
         this.updateValidMovesFromGameState();
@@ -1,6 +1,8 @@
 import asyncio
+import logging
 from server.server import GameServer
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     server = GameServer()
     asyncio.run(server.start())
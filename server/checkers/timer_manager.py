@@ -1,8 +1,11 @@
 import asyncio
+import logging
 import time
 from typing import Dict, Callable, Optional
 from server.core.state import GlobalState
 
+logger = logging.getLogger(__name__)
+
 class TimerManager:
     def __init__(self, timeout_callback: Callable):
         self.state = GlobalState.get_instance()
@@ -24,9 +27,9 @@ class TimerManager:
     
     async def check_timeouts(self):
         """Check all active games for timeouts"""
-        current_time = time.time() * 1000  # Convert to milliseconds
+        current_time = time.time_ns() // 1_000_000  # Epoch milliseconds, read once per sweep
         
-        all_lobbies = self.state.get_all_lobbies()
+        all_lobbies = await self.state.aget_all_lobbies()
         for lobby_code, lobby in all_lobbies.items():
             if not lobby.game_state or lobby.game_state.get('game_over'):
                 continue
@@ -34,11 +37,11 @@ class TimerManager:
             # Check if all players are disconnected - if so, end the game
             connected_players = [p for p in lobby.players if p.websocket is not None]
             if not connected_players:
-                print(f"[TIMER] All players disconnected in lobby {lobby_code}, ending game")
+                logger.info("[TIMER] All players disconnected in lobby %s, ending game", lobby_code)
                 lobby.game_state['game_over'] = True
                 lobby.game_state['winner'] = None  # Draw due to abandonment
                 lobby.game_state['timeout_player'] = None
-                self.state.update_lobby_game_state(lobby_code, lobby.game_state)
+                self.state.update_lobby_game_fields(lobby_code, {'game_over': True, 'winner': None, 'timeout_player': None})
                 continue
                 
             clock = lobby.game_state.get('clock')
@@ -54,20 +57,8 @@ class TimerManager:
             if not last_turn_start:
                 continue
                 
-            # Calculate elapsed time since turn started
-            if isinstance(last_turn_start, str):
-                # Handle ISO string format
-                try:
-                    import datetime
-                    # Handle both with and without 'Z' suffix for UTC
-                    last_turn_clean = last_turn_start.rstrip('Z')
-                    last_dt = datetime.datetime.fromisoformat(last_turn_clean)
-                    elapsed_ms = (datetime.datetime.utcnow() - last_dt).total_seconds() * 1000
-                except:
-                    continue
-            else:
-                # Handle timestamp format
-                elapsed_ms = current_time - float(last_turn_start)
+            # Calculate elapsed time since turn started (epoch ms, normalised when the lobby is loaded)
+            elapsed_ms = current_time - last_turn_start
             
             # Get current player's remaining time
             time_key = f'{current_turn}_ms'
@@ -76,18 +67,18 @@ class TimerManager:
             # Check if time has run out (remaining time minus elapsed time)
             time_left = remaining_time - elapsed_ms
             if time_left <= 0:
-                print(f"[TIMER] Timeout detected in lobby {lobby_code}, player {current_turn}, remaining: {remaining_time}, elapsed: {elapsed_ms}, time_left: {time_left}")
+                logger.debug("[TIMER] Timeout detected in lobby %s, player %s, remaining: %s, elapsed: %s, time_left: %s", lobby_code, current_turn, remaining_time, elapsed_ms, time_left)
                 # Player has timed out - only process if not already processing and game isn't over
                 if lobby_code not in self.processing_timeouts and not lobby.game_state.get('game_over'):
                     # Mark this lobby as processing timeout to prevent multiple processing
                     self.processing_timeouts.add(lobby_code)
                     
                     winner = 'black' if current_turn == 'white' else 'white'
-                    print(f"[TIMER] Setting winner to {winner} for lobby {lobby_code}")
+                    logger.debug("[TIMER] Setting winner to %s for lobby %s", winner, lobby_code)
                     
                     try:
                         # Call timeout callback - it will handle game state updates
-                        print(f"[TIMER] Calling timeout callback for lobby {lobby_code}")
+                        logger.debug("[TIMER] Calling timeout callback for lobby %s", lobby_code)
                         await self.timeout_callback(lobby_code, current_turn, winner)
                         
                     finally:
@@ -95,6 +86,6 @@ class TimerManager:
                         self.processing_timeouts.discard(lobby_code)
                     
                 elif lobby.game_state.get('game_over'):
-                    print(f"[TIMER] Game already over in lobby {lobby_code}, skipping timeout")
+                    logger.debug("[TIMER] Game already over in lobby %s, skipping timeout", lobby_code)
                 else:
-                    print(f"[TIMER] Timeout already being processed for lobby {lobby_code}, skipping")
\ No newline at end of file
+                    logger.debug("[TIMER] Timeout already being processed for lobby %s, skipping", lobby_code)
\ No newline at end of file
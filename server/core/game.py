@@ -3,7 +3,126 @@ from typing import Dict, List, Optional, Tuple
 from sympy import PoleError
 from .enums import PieceType, Color
 from .piece import Piece
-import datetime
+import time
+from .zobrist import splitmix64_stream
+
+# Bitboards: square (row, col) is bit row * 8 + col of an int
+_OPPONENT = {Color.WHITE: Color.BLACK, Color.BLACK: Color.WHITE}
+
+def _ray(sq: int, dr: int, dc: int) -> int:
+    """Squares reached from sq stepping (dr, dc) until the board edge"""
+    mask = 0
+    r, c = (sq >> 3) + dr, (sq & 7) + dc
+    while 0 <= r < 8 and 0 <= c < 8:
+        mask |= 1 << (r * 8 + c)
+        r += dr
+        c += dc
+    return mask
+
+def _leaps(sq: int, offsets) -> int:
+    """Squares one (dr, dc) jump away from sq"""
+    mask = 0
+    for dr, dc in offsets:
+        r, c = (sq >> 3) + dr, (sq & 7) + dc
+        if 0 <= r < 8 and 0 <= c < 8:
+            mask |= 1 << (r * 8 + c)
+    return mask
+
+# (rays per square, nearest square is the lowest set bit) for each direction a slider moves in
+_ROOK_RAYS = tuple(([_ray(sq, dr, dc) for sq in range(64)], dr > 0 or (dr == 0 and dc > 0))
+                   for dr, dc in ((-1, 0), (1, 0), (0, -1), (0, 1)))
+_BISHOP_RAYS = tuple(([_ray(sq, dr, dc) for sq in range(64)], dr > 0)
+                     for dr, dc in ((-1, -1), (-1, 1), (1, -1), (1, 1)))
+
+def _ray_attacks(sq: int, occupied: int, rays) -> int:
+    """Squares a slider on sq reaches along rays, up to and including the first occupied square"""
+    attacks = 0
+    for ray_table, nearest_is_lowest in rays:
+        ray = ray_table[sq]
+        blockers = ray & occupied
+        if blockers:
+            nearest = (blockers & -blockers).bit_length() - 1 if nearest_is_lowest else blockers.bit_length() - 1
+            ray ^= ray_table[nearest]
+        attacks |= ray
+    return attacks
+
+def _relevant_mask(sq: int, rays) -> int:
+    """Squares whose occupancy can change a slider's attacks from sq: each ray minus its edge square"""
+    mask = 0
+    for ray_table, nearest_is_lowest in rays:
+        ray = ray_table[sq]
+        if ray:
+            edge = ray.bit_length() - 1 if nearest_is_lowest else (ray & -ray).bit_length() - 1
+            mask |= ray ^ (1 << edge)
+    return mask
+
+_FULL_BOARD = (1 << 64) - 1
+_SQUARE_POS = [(sq >> 3, sq & 7) for sq in range(64)]
+
+def _squares(bb: int) -> List[tuple]:
+    """(row, col) of every set bit, lowest square first"""
+    squares = []
+    while bb:
+        low = bb & -bb
+        squares.append(_SQUARE_POS[low.bit_length() - 1])
+        bb ^= low
+    return squares
+
+# Direct-lookup slider attacks: per square, relevant blockers -> attack bitboard. The tables
+# are filled on first use of each blocker pattern instead of all ~107k entries at import.
+_ROOK_MASKS = [_relevant_mask(sq, _ROOK_RAYS) for sq in range(64)]
+_BISHOP_MASKS = [_relevant_mask(sq, _BISHOP_RAYS) for sq in range(64)]
+_ROOK_TABLE = [{} for _ in range(64)]
+_BISHOP_TABLE = [{} for _ in range(64)]
+
+def _rook_attacks(sq: int, occupied: int) -> int:
+    blockers = occupied & _ROOK_MASKS[sq]
+    attacks = _ROOK_TABLE[sq].get(blockers)
+    if attacks is None:
+        attacks = _ROOK_TABLE[sq][blockers] = _ray_attacks(sq, blockers, _ROOK_RAYS)
+    return attacks
+
+def _bishop_attacks(sq: int, occupied: int) -> int:
+    blockers = occupied & _BISHOP_MASKS[sq]
+    attacks = _BISHOP_TABLE[sq].get(blockers)
+    if attacks is None:
+        attacks = _BISHOP_TABLE[sq][blockers] = _ray_attacks(sq, blockers, _BISHOP_RAYS)
+    return attacks
+
+_KNIGHT_ATTACKS = [_leaps(sq, ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))) for sq in range(64)]
+_KING_ATTACKS = [_leaps(sq, ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))) for sq in range(64)]
+# where a pawn of each colour must stand to attack sq: white pawns capture towards row 0
+_PAWN_ATTACKERS = {
+    Color.WHITE: [_leaps(sq, ((1, -1), (1, 1))) for sq in range(64)],
+    Color.BLACK: [_leaps(sq, ((-1, -1), (-1, 1))) for sq in range(64)],
+}
+
+def _between_table() -> List[List[int]]:
+    """between[a][b]: squares strictly between two squares on a shared line, else 0"""
+    between = [[0] * 64 for _ in range(64)]
+    for sq in range(64):
+        for dr, dc in ((-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1)):
+            mask = 0
+            r, c = (sq >> 3) + dr, (sq & 7) + dc
+            while 0 <= r < 8 and 0 <= c < 8:
+                between[sq][r * 8 + c] = mask
+                mask |= 1 << (r * 8 + c)
+                r += dr
+                c += dc
+    return between
+
+_BETWEEN = _between_table()
+
+# Zobrist keys for position hashing: piece type/colour, each held ability and the has_moved
+# flag (castling rights) per square, plus side to move and the en passant target square
+_zobrist_keys = splitmix64_stream(0x5EED)
+_PIECE_INDEX = {pt: i for i, pt in enumerate(PieceType)}
+_Z_PIECE = [next(_zobrist_keys) for _ in range(64 * 6 * 2)]  # (sq * 6 + type) * 2 + colour
+_Z_ABILITY = [next(_zobrist_keys) for _ in range(64 * 6)]    # sq * 6 + ability
+_Z_MOVED = [next(_zobrist_keys) for _ in range(64)]
+_Z_EN_PASSANT = [next(_zobrist_keys) for _ in range(64)]
+_Z_BLACK_TO_MOVE = next(_zobrist_keys)
+del _zobrist_keys
 
 class ChessGame:
     def __init__(self):
@@ -17,12 +136,31 @@ class ChessGame:
         self.en_passant_target = None  # (row, col) of pawn that can be captured en passant
         self.promotion_pending: Optional[Dict] = None  # {'row': int, 'col': int, 'color': Color}
         self.valid_moves = {}  # Dictionary to store valid moves for each piece
+        self.occupancy = {Color.WHITE: 0, Color.BLACK: 0}  # bitboard of the squares each side holds
+        self.change_log = []  # (row, col) of squares changed by moves and promotions, see pop_change_log
         self._initialize_board()
         self.white_ms = 0
         self.black_ms = 0
         #self.pieces = []  # List to track all pieces on the board
         self.king_castled = {Color.WHITE: False, Color.BLACK: False}  # Track if each king has castled
 
+    def copy(self) -> 'ChessGame':
+        """Independent copy to try moves on; pieces, board and the containers moves modify are not shared"""
+        game = ChessGame.__new__(ChessGame)
+        game.__dict__.update(self.__dict__)
+        game.board = [[Piece(p.type, p.color, list(p.abilities), p.position, p.has_moved) if p else None for p in row]
+                      for row in self.board]
+        game.occupancy = dict(self.occupancy)
+        game.move_history = list(self.move_history)
+        if game.move_history:
+            # apply_promotion completes the last entry in place
+            game.move_history[-1] = dict(game.move_history[-1])
+        game.promotion_pending = dict(self.promotion_pending) if self.promotion_pending else None
+        game.king_castled = dict(self.king_castled)
+        game.valid_moves = {}
+        game.change_log = list(self.change_log)
+        return game
+
     def load_from_state(self, game_state: Dict):
         """Load game state from a dictionary, ensuring clock fields are always initialized"""
         self.board = [[None for _ in range(8)] for _ in range(8)]
@@ -31,12 +169,15 @@ class ChessGame:
                 pdata = game_state['board'][row][col]
                 self.board[row][col] = Piece.from_dict(pdata) if pdata else None
                 # self.pieces.append(self.board[row][col]) if self.board[row][col] else None
+        self._rebuild_occupancy()
+        self.change_log = []
 
         self.current_turn = Color(game_state['current_turn']) if isinstance(game_state['current_turn'], str) else game_state['current_turn']
         self.game_over = game_state.get('game_over', False)
         winner = game_state.get('winner')
         self.winner = Color(winner) if winner else None
-        self.move_history = game_state.get('move_history', [])
+        # Copied: moves appended to this game must not show up in the caller's state
+        self.move_history = list(game_state.get('move_history', []))
         self.white_king_in_check = game_state.get('white_king_in_check', False)
         self.black_king_in_check = game_state.get('black_king_in_check', False)
         ep = game_state.get('en_passant_target')
@@ -49,43 +190,74 @@ class ChessGame:
         clock = game_state.get('clock', {})
         self.last_turn_start = clock.get('last_turn_start') or game_state.get('last_turn_start')
         if self.last_turn_start is None:
-            # Use UTC ISO string format for consistency
-            self.last_turn_start = datetime.datetime.utcnow().isoformat() + 'Z'
+            # Epoch milliseconds, matching the clock dict
+            self.last_turn_start = time.time_ns() // 1_000_000
         return self
 
+    def zobrist_hash(self) -> int:
+        """64-bit key of everything move generation depends on (computed from the board)"""
+        key = _Z_BLACK_TO_MOVE if self.current_turn == Color.BLACK else 0
+        if self.en_passant_target:
+            ep_row, ep_col = self.en_passant_target
+            key ^= _Z_EN_PASSANT[ep_row * 8 + ep_col]
+        board = self.board
+        for color in (Color.WHITE, Color.BLACK):
+            colour_index = 0 if color == Color.WHITE else 1
+            own = self.occupancy[color]
+            while own:
+                low = own & -own
+                sq = low.bit_length() - 1
+                piece = board[sq >> 3][sq & 7]
+                key ^= _Z_PIECE[(sq * 6 + _PIECE_INDEX[piece.type]) * 2 + colour_index]
+                for ability in piece.abilities:
+                    key ^= _Z_ABILITY[sq * 6 + _PIECE_INDEX[ability]]
+                if piece.has_moved:
+                    key ^= _Z_MOVED[sq]
+                own ^= low
+        return key
+
     def calculate_moves(self) -> Dict[tuple, list]:
         """Fast calculation of all valid moves for all pieces of the current turn."""
         moves = {}
         color = self.current_turn
-        king_pos = None
-        pieces = []
-        for r in range(8):
-            for c in range(8):
-                p = self.get_piece_at(r, c)
-                if p and p.type == PieceType.KING and p.color == color:
-                    king_pos = (r, c)
-                if p and p.color == color:
-                    pieces.append((r, c, p))
+        pieces = self._pieces_of(color)
+        king_pos = next(((r, c) for r, c, p in pieces if p.type == PieceType.KING), None)
 
+        occupancy = self.occupancy
+        board = self.board
         for row, col, piece in pieces:
+            # Squares come out as the shared _SQUARE_POS tuples, so the only allocation
+            # per piece is its target list; seen dedupes targets two abilities share
             valid_moves = []
-            pseudo_moves = self._get_valid_moves_for_ability((row, col))
-            for to_row, to_col in pseudo_moves:
-                if (to_row, to_col) in valid_moves:
+            seen = 0
+            from_bit = 1 << (row * 8 + col)
+            is_king = piece.type == PieceType.KING
+            for to_row, to_col in self._get_valid_moves_for_ability((row, col)):
+                to_sq = to_row * 8 + to_col
+                to_bit = 1 << to_sq
+                if seen & to_bit:
                     continue
-                captured = self.board[to_row][to_col]
-                self.board[to_row][to_col] = piece
-                self.board[row][col] = None
+                seen |= to_bit
+                to_pos = _SQUARE_POS[to_sq]
+                captured = board[to_row][to_col]
+                board[to_row][to_col] = piece
+                board[row][col] = None
+                occupancy[color] ^= from_bit | to_bit
+                if captured:
+                    occupancy[captured.color] ^= to_bit
                 orig_pos = piece.position
-                piece.position = (to_row, to_col)
-                king_check = self._is_king_in_check(piece.color, king_pos)
-                self.board[row][col] = piece
-                self.board[to_row][to_col] = captured
+                piece.position = to_pos
+                king_check = self._is_king_in_check(color, to_pos if is_king else king_pos)
+                board[row][col] = piece
+                board[to_row][to_col] = captured
+                occupancy[color] ^= from_bit | to_bit
+                if captured:
+                    occupancy[captured.color] ^= to_bit
                 piece.position = orig_pos
                 if not king_check:
-                    valid_moves.append((to_row, to_col))
+                    valid_moves.append(to_pos)
             if valid_moves:
-                moves[(row, col)] = valid_moves
+                moves[_SQUARE_POS[row * 8 + col]] = valid_moves
         return moves
 
     def _would_move_put_king_in_check(self, piece: 'Piece', from_pos: tuple, to_pos: tuple) -> bool:
@@ -95,8 +267,8 @@ class ChessGame:
         
         # Simulate the move
         captured_piece = self.get_piece_at(to_row, to_col)
-        self.board[to_row][to_col] = piece
-        self.board[from_row][from_col] = None
+        self._put(to_row, to_col, piece)
+        self._put(from_row, from_col, None)
         original_position = piece.position
         piece.position = (to_row, to_col)
         
@@ -104,8 +276,8 @@ class ChessGame:
         king_in_check = self._is_king_in_check(piece.color)
         
         # Revert the move
-        self.board[from_row][from_col] = piece
-        self.board[to_row][to_col] = captured_piece
+        self._put(from_row, from_col, piece)
+        self._put(to_row, to_col, captured_piece)
         piece.position = original_position
         
         return king_in_check
@@ -114,16 +286,16 @@ class ChessGame:
         """Initialize the chess board with pieces in their starting positions"""
         # Initialize pawns
         for col in range(8):
-            self.board[1][col] = Piece(PieceType.PAWN, Color.BLACK, [PieceType.PAWN], (1, col))
-            self.board[6][col] = Piece(PieceType.PAWN, Color.WHITE, [PieceType.PAWN], (6, col))
+            self._put(1, col, Piece(PieceType.PAWN, Color.BLACK, [PieceType.PAWN], (1, col)))
+            self._put(6, col, Piece(PieceType.PAWN, Color.WHITE, [PieceType.PAWN], (6, col)))
         
         # Initialize other pieces
         piece_order = [PieceType.ROOK, PieceType.KNIGHT, PieceType.BISHOP, PieceType.QUEEN, 
                       PieceType.KING, PieceType.BISHOP, PieceType.KNIGHT, PieceType.ROOK]
         
         for col, piece_type in enumerate(piece_order):
-            self.board[0][col] = Piece(piece_type, Color.BLACK, [piece_type], (0, col))
-            self.board[7][col] = Piece(piece_type, Color.WHITE, [piece_type], (7, col))
+            self._put(0, col, Piece(piece_type, Color.BLACK, [piece_type], (0, col)))
+            self._put(7, col, Piece(piece_type, Color.WHITE, [piece_type], (7, col)))
 
     def get_piece_at(self, row: int, col: int) -> Optional[Piece]:
         if 0 <= row < 8 and 0 <= col < 8:
@@ -132,7 +304,39 @@ class ChessGame:
 
     def set_piece_at(self, row: int, col: int, piece: Optional[Piece]):
         if 0 <= row < 8 and 0 <= col < 8:
-            self.board[row][col] = piece
+            self._put(row, col, piece)
+
+    def _put(self, row: int, col: int, piece: Optional[Piece]):
+        """Write a square and keep the occupancy bitboards in step"""
+        bit = 1 << (row * 8 + col)
+        old = self.board[row][col]
+        if old is not None:
+            self.occupancy[old.color] &= ~bit
+        if piece is not None:
+            self.occupancy[piece.color] |= bit
+        self.board[row][col] = piece
+
+    def _pieces_of(self, color: Color) -> List[tuple]:
+        """(row, col, piece) for each piece of color in board order, read off its occupancy bitboard"""
+        board = self.board
+        pieces = []
+        own = self.occupancy[color]
+        while own:
+            low = own & -own
+            sq = low.bit_length() - 1
+            pieces.append((sq >> 3, sq & 7, board[sq >> 3][sq & 7]))
+            own ^= low
+        return pieces
+
+    def _rebuild_occupancy(self):
+        """Recompute the occupancy bitboards after the board is replaced wholesale"""
+        occupancy = {Color.WHITE: 0, Color.BLACK: 0}
+        for row in range(8):
+            for col in range(8):
+                piece = self.board[row][col]
+                if piece is not None:
+                    occupancy[piece.color] |= 1 << (row * 8 + col)
+        self.occupancy = occupancy
 
     def move_piece(self, from_pos: tuple, to_pos: tuple) -> bool:
         from_row, from_col = from_pos
@@ -155,17 +359,7 @@ class ChessGame:
         if not move_allowed:
             return False
         # Simulate move for king-in-check validation
-        captured_piece = self.get_piece_at(to_row, to_col)
-        self.board[to_row][to_col] = piece
-        self.board[from_row][from_col] = None
-        original_position = piece.position
-        piece.position = (to_row, to_col)
-        king_in_check = self._is_king_in_check(piece.color)
-        # Revert
-        self.board[from_row][from_col] = piece
-        self.board[to_row][to_col] = captured_piece
-        piece.position = original_position
-        if king_in_check:
+        if self._would_move_put_king_in_check(piece, from_pos, to_pos):
             return False
 
         # Now do the move for real
@@ -187,8 +381,9 @@ class ChessGame:
             rook = self.get_piece_at(from_row, rook_col)
             if rook and rook.type == PieceType.ROOK and not rook.has_moved and self._is_valid_king_move(piece, from_pos, to_pos):
                 new_rook_col = to_col - direction
-                self.board[from_row][new_rook_col] = rook
-                self.board[from_row][rook_col] = None
+                self._put(from_row, new_rook_col, rook)
+                self._put(from_row, rook_col, None)
+                self.change_log += ((from_row, new_rook_col), (from_row, rook_col))
                 rook.position = (from_row, new_rook_col)
                 rook.has_moved = True
                 # Mark king as castled
@@ -200,11 +395,13 @@ class ChessGame:
             en_passant_row = to_row + (1 if piece.color == Color.WHITE else -1)
             en_passant_captured = self.get_piece_at(en_passant_row, to_col)
             if en_passant_captured:
-                self.board[en_passant_row][to_col] = None
+                self._put(en_passant_row, to_col, None)
+                self.change_log.append((en_passant_row, to_col))
 
         # Move the piece
-        self.board[to_row][to_col] = piece
-        self.board[from_row][from_col] = None
+        self._put(to_row, to_col, piece)
+        self._put(from_row, from_col, None)
+        self.change_log += ((to_row, to_col), (from_row, from_col))
         piece.position = to_pos
         piece.has_moved = True
 
@@ -217,7 +414,7 @@ class ChessGame:
             self.promotion_pending = {
                 'row': to_row,
                 'col': to_col,
-                'color': piece.color.value,
+                'color': piece.color_str,
                 'from': (from_row, from_col)
             }
             became_promotion = True
@@ -226,10 +423,10 @@ class ChessGame:
         move_record = {
             'from': from_pos,
             'to': to_pos,
-            'piece': piece.type.value,
-            'captured': captured_piece.type.value if captured_piece else None,
-            'en_passant_captured': en_passant_captured.type.value if en_passant_captured else None,
-            'abilities_gained': captured_piece.type.value if captured_piece else None
+            'piece': piece.type_str,
+            'captured': captured_piece.type_str if captured_piece else None,
+            'en_passant_captured': en_passant_captured.type_str if en_passant_captured else None,
+            'abilities_gained': captured_piece.type_str if captured_piece else None
         }
         if became_promotion:
             move_record['promoted_to'] = None
@@ -257,59 +454,21 @@ class ChessGame:
                 if(ab == PieceType.ROOK or ab == PieceType.BISHOP) and PieceType.QUEEN in piece.abilities:
                     continue
                 moves.extend(self._get_valid_moves_for_ability(from_pos, ab))
+        sq = row * 8 + col
+        own = self.occupancy[piece.color]
         if ability == PieceType.KNIGHT:
             # All 8 possible knight jumps
-            for dr, dc in [(-2,-1), (-2,1), (-1,-2), (-1,2), (1,-2), (1,2), (2,-1), (2,1)]:
-                r, c = row + dr, col + dc
-                if 0 <= r < 8 and 0 <= c < 8:
-                    target = self.get_piece_at(r, c)
-                    if not target or target.color != piece.color:
-                        moves.append((r, c))
-        elif ability == PieceType.BISHOP:
-            # 4 diagonals
-            for dr, dc in [(-1,-1), (-1,1), (1,-1), (1,1)]:
-                r, c = row + dr, col + dc
-                while 0 <= r < 8 and 0 <= c < 8:
-                    target = self.get_piece_at(r, c)
-                    if not target:
-                        moves.append((r, c))
-                    elif target.color != piece.color:
-                        moves.append((r, c))
-                        break
-                    else:
-                        break
-                    r += dr
-                    c += dc
-        elif ability == PieceType.ROOK:
-            # 4 straight lines
-            for dr, dc in [(-1,0), (1,0), (0,-1), (0,1)]:
-                r, c = row + dr, col + dc
-                while 0 <= r < 8 and 0 <= c < 8:
-                    target = self.get_piece_at(r, c)
-                    if not target:
-                        moves.append((r, c))
-                    elif target.color != piece.color:
-                        moves.append((r, c))
-                        break
-                    else:
-                        break
-                    r += dr
-                    c += dc
-        elif ability == PieceType.QUEEN:
-            # Combine rook and bishop
-            moves.extend(self._get_valid_moves_for_ability(from_pos, PieceType.ROOK))
-            moves.extend(self._get_valid_moves_for_ability(from_pos, PieceType.BISHOP))
+            moves.extend(_squares(_KNIGHT_ATTACKS[sq] & ~own))
+        elif ability in (PieceType.BISHOP, PieceType.ROOK, PieceType.QUEEN):
+            # Lines up to the first piece, capturing it if it is an enemy
+            occupied = own | self.occupancy[_OPPONENT[piece.color]]
+            if ability != PieceType.BISHOP:
+                moves.extend(_squares(_rook_attacks(sq, occupied) & ~own))
+            if ability != PieceType.ROOK:
+                moves.extend(_squares(_bishop_attacks(sq, occupied) & ~own))
         elif ability == PieceType.KING:
             # All adjacent squares
-            for dr in [-1, 0, 1]:
-                for dc in [-1, 0, 1]:
-                    if dr == 0 and dc == 0:
-                        continue
-                    r, c = row + dr, col + dc
-                    if 0 <= r < 8 and 0 <= c < 8:
-                        target = self.get_piece_at(r, c)
-                        if not target or target.color != piece.color:
-                            moves.append((r, c))
+            moves.extend(_squares(_KING_ATTACKS[sq] & ~own))
             # Castling
             if not piece.has_moved:
                 for direction in [-1, 1]:
@@ -368,6 +527,7 @@ class ChessGame:
             for col in range(8):
                 pdata = board_data[row][col]
                 self.board[row][col] = Piece.from_dict(pdata) if pdata else None
+        self._rebuild_occupancy()
 
     def _is_valid_move(self, piece: Piece, from_pos: tuple, to_pos: tuple) -> bool:
         """Check if a move is valid according to chess rules"""
@@ -396,35 +556,6 @@ class ChessGame:
 
     # ... (Rest of the movement validation methods from server.py)
     
-    def get_board_state(self) -> Dict:
-        board_state = []
-        for row in self.board:
-            row_state = []
-            for piece in row:
-                if piece:
-                    row_state.append({
-                        'type': piece.type.value,
-                        'color': piece.color.value,
-                        'abilities': [ability.value for ability in piece.abilities],
-                        'position': piece.position,
-                        'has_moved': piece.has_moved
-                    })
-                else:
-                    row_state.append(None)
-            board_state.append(row_state)
-        return {
-            'board': board_state,
-            'current_turn': self.current_turn.value,
-            'game_over': self.game_over,
-            'winner': self.winner.value if self.winner else None,
-            'move_history': self.move_history,
-            'white_king_in_check': getattr(self, 'white_king_in_check', False),
-            'black_king_in_check': getattr(self, 'black_king_in_check', False),
-            'en_passant_target': self.en_passant_target,
-            'promotion_pending': self.promotion_pending,
-            'promotion_cancel_allowed': True
-        }
-        
     def _is_valid_move_for_ability(self, piece: Piece, from_pos: tuple, to_pos: tuple, ability: PieceType) -> bool:
         """Check if a move is valid for a specific ability"""
         if ability == PieceType.PAWN:
@@ -542,50 +673,49 @@ class ChessGame:
 
     def _square_attacked(self, pos: tuple, defender_color: Color) -> bool:
         # attacker is the opposite color
-        attacker_color = Color.BLACK if defender_color == Color.WHITE else Color.WHITE
         r, c = pos
-        for row in range(8):
-            for col in range(8):
-                attacker = self.get_piece_at(row, col)
-                if attacker and attacker.color == attacker_color:
-                    if self._is_valid_move_for_ability(attacker, (row, col), (r, c), attacker.type):
-                        return True
-                    # Also check other abilities if attacker has multiple
-                    for ability in attacker.abilities:
-                        if ability != attacker.type and self._is_valid_move_for_ability(attacker, (row, col), (r, c), ability):
-                            return True
+        return self._attacked_by(r * 8 + c, _OPPONENT[defender_color])
+
+    def _attacked_by(self, sq: int, attacker_color: Color) -> bool:
+        """True if a piece of attacker_color holds an ability that attacks square sq"""
+        board = self.board
+        enemy = self.occupancy[attacker_color]
+        occupied = enemy | self.occupancy[_OPPONENT[attacker_color]]
+        queen = PieceType.QUEEN
+        # a piece on a square sq attacks with some ability is an attacker if it holds that ability;
+        # slider lines stop at the first piece, so only the nearest one on each line is a candidate
+        for attackers, ability, also in ((_rook_attacks(sq, occupied), PieceType.ROOK, queen),
+                                         (_bishop_attacks(sq, occupied), PieceType.BISHOP, queen),
+                                         (_KNIGHT_ATTACKS[sq], PieceType.KNIGHT, None),
+                                         (_KING_ATTACKS[sq], PieceType.KING, None),
+                                         (_PAWN_ATTACKERS[attacker_color][sq], PieceType.PAWN, None)):
+            attackers &= enemy
+            while attackers:
+                low = attackers & -attackers
+                s = low.bit_length() - 1
+                abilities = board[s >> 3][s & 7].abilities
+                if ability in abilities or also in abilities:
+                    return True
+                attackers ^= low
         return False
     
     def _has_legal_moves(self, color: Color) -> bool:
         """Check if the given color has any legal moves available"""
-        for row in range(8):
-            for col in range(8):
-                piece = self.get_piece_at(row, col)
-                if piece and piece.color == color:
-                    # Try all possible moves for this piece
-                    for to_row in range(8):
-                        for to_col in range(8):
-                            if self._is_valid_move(piece, (row, col), (to_row, to_col)):
-                                return True
+        # Squares holding one of color's own pieces can never be a target
+        targets = _squares(~self.occupancy[color] & _FULL_BOARD)
+        for row, col, piece in self._pieces_of(color):
+            # Try all possible moves for this piece
+            for to_pos in targets:
+                if self._is_valid_move(piece, (row, col), to_pos):
+                    return True
         return False
     
     def _is_path_clear(self, from_pos: tuple, to_pos: tuple) -> bool:
         from_row, from_col = from_pos
         to_row, to_col = to_pos
-        
-        # Determine direction
-        row_step = 0 if to_row == from_row else (1 if to_row > from_row else -1)
-        col_step = 0 if to_col == from_col else (1 if to_col > from_col else -1)
-        
-        # Check each square along the path
-        current_row, current_col = from_row + row_step, from_col + col_step
-        while current_row != to_row or current_col != to_col:
-            if self.get_piece_at(current_row, current_col) is not None:
-                return False
-            current_row += row_step
-            current_col += col_step
-        
-        return True
+        occupancy = self.occupancy
+        return not (_BETWEEN[from_row * 8 + from_col][to_row * 8 + to_col]
+                    & (occupancy[Color.WHITE] | occupancy[Color.BLACK]))
     
     def _transfer_abilities(self, capturing_piece: 'Piece', captured_piece: 'Piece'):
         """Transfer abilities from captured piece to capturing piece"""
@@ -637,38 +767,21 @@ class ChessGame:
     
     def _is_king_in_check(self, king_color: Color, king_pos: Optional[Tuple[int, int]] = None) -> bool:
         """Check if the king of the given color is in check. If king_pos is provided, use it for speed."""
-        # Use provided king_pos if available, else find the king
+        # Use provided king_pos if available, else find the king among the side's own squares
         if king_pos is None:
-            for row in range(8):
-                for col in range(8):
-                    piece = self.get_piece_at(row, col)
-                    if piece and piece.type == PieceType.KING and piece.color == king_color:
-                        king_pos = (row, col)
-                        break
-                if king_pos:
+            own = self.occupancy[king_color]
+            while own:
+                low = own & -own
+                s = low.bit_length() - 1
+                if self.board[s >> 3][s & 7].type == PieceType.KING:
+                    king_pos = (s >> 3, s & 7)
                     break
+                own ^= low
         if not king_pos:
             return False
         # Check if any opponent piece can attack the king
-        opponent_color = Color.BLACK if king_color == Color.WHITE else Color.WHITE
-        for row in range(8):
-            for col in range(8):
-                piece = self.get_piece_at(row, col)
-                if piece and piece.color == opponent_color:
-                    # Check if this piece can attack the king
-                    if self._can_attack_king(piece, (row, col), king_pos):
-                        return True
-        return False
+        return self._attacked_by(king_pos[0] * 8 + king_pos[1], _OPPONENT[king_color])
     
-    def _can_attack_king(self, piece: Piece, from_pos: tuple, king_pos: tuple) -> bool:
-        """Check if a piece can attack the king at the given position"""
-        # Use the same move validation logic but check if it can reach the king
-        for ability in piece.abilities:
-            if self._is_valid_move_for_ability(piece, from_pos, king_pos, ability):
-                return True
-        return False
-    
- 
     def apply_promotion(self, row: int, col: int, new_type: PieceType):
         pawn = self.get_piece_at(row, col)
         if not pawn or pawn.type != PieceType.PAWN or not self.promotion_pending:
@@ -678,9 +791,10 @@ class ChessGame:
         original_abilities = pawn.abilities.copy()
         
         # Apply promotion: change type and add new ability if not already present
-        pawn.type = new_type
+        pawn.set_type(new_type)
         if new_type not in pawn.abilities:
             pawn.abilities.append(new_type)
+        self.change_log.append((row, col))
         
         # Check if this was a capture move by looking at the last move in history
         last_move = self.move_history[-1] if self.move_history else None
@@ -700,7 +814,7 @@ class ChessGame:
         if last_move:
             last_move['promoted_to'] = new_type.value
             last_move['final_piece'] = new_type.value
-            last_move['abilities_gained'] = [ability.value for ability in pawn.abilities]
+            last_move['abilities_gained'] = pawn.ability_strs()
         
         self.promotion_pending = None
         
@@ -721,8 +835,9 @@ class ChessGame:
         from_row, from_col = self.promotion_pending['from']
         pawn = self.get_piece_at(row, col)
         # Move the pawn back to original position
-        self.board[from_row][from_col] = pawn
-        self.board[row][col] = None
+        self._put(from_row, from_col, pawn)
+        self._put(row, col, None)
+        self.change_log += ((from_row, from_col), (row, col))
         if pawn:
             pawn.position = (from_row, from_col)
         self.promotion_pending = None
@@ -732,24 +847,20 @@ class ChessGame:
         """Check if there is a promotion pending"""
         return self.promotion_pending is not None
 
-    def get_board_state(self) -> Dict:
-        board_state = []
-        for row in self.board:
-            row_state = []
-            for piece in row:
-                if piece:
-                    row_state.append({
-                        'type': piece.type.value,
-                        'color': piece.color.value,
-                        'abilities': [ability.value for ability in piece.abilities],
-                        'position': piece.position,
-                        'has_moved': piece.has_moved
-                    })
-                else:
-                    row_state.append(None)
-            board_state.append(row_state)
+    def pop_change_log(self) -> List[tuple]:
+        """(row, col, piece dict or None) for each square changed since the last call, then start a new log"""
+        board = self.board
+        changes = []
+        for row, col in dict.fromkeys(self.change_log):
+            piece = board[row][col]
+            changes.append((row, col, piece.to_dict() if piece else None))
+        self.change_log = []
+        return changes
+
+    def get_board_state(self, board: Optional[list] = None) -> Dict:
+        """Serializable game state; board is an already serialized copy of self.board, if the caller has one"""
         return {
-            'board': board_state,
+            'board': self.serialize_board() if board is None else board,
             'current_turn': self.current_turn.value,
             'game_over': self.game_over,
             'winner': self.winner.value if self.winner else None,
@@ -761,31 +872,22 @@ class ChessGame:
             'promotion_cancel_allowed': True
         }
     
-    def calculate_moves_fast(self) -> Dict[tuple, list]:
-        """High-speed calculation of all legal moves for the current turn."""
+    def calculate_moves_fast(self, color: Optional[Color] = None) -> Dict[tuple, list]:
+        """High-speed calculation of all legal moves for color (default: the current turn)."""
         moves = {}
-        color = self.current_turn
+        if color is None:
+            color = self.current_turn
 
         # Precompute king position
-        king_pos = None
-        pieces = []
-        for r in range(8):
-            for c in range(8):
-                p = self.get_piece_at(r, c)
-                if p and p.color == color:
-                    pieces.append((r, c, p))
-                    if p.type == PieceType.KING:
-                        king_pos = (r, c)
-
-        # Direction vectors for sliding pieces
-        rook_dirs = [(-1,0),(1,0),(0,-1),(0,1)]
-        bishop_dirs = [(-1,-1),(-1,1),(1,-1),(1,1)]
-        queen_dirs = rook_dirs + bishop_dirs
-        knight_offsets = [(-2,-1),(-2,1),(-1,-2),(-1,2),(1,-2),(1,2),(2,-1),(2,1)]
-        king_offsets = [(-1,-1),(-1,0),(-1,1),(0,-1),(0,1),(1,-1),(1,0),(1,1)]
+        pieces = self._pieces_of(color)
+        king_pos = next(((r, c) for r, c, p in pieces if p.type == PieceType.KING), None)
+
+        own = self.occupancy[color]
+        occupied = own | self.occupancy[_OPPONENT[color]]
 
         for row, col, piece in pieces:
             valid_moves = set()
+            sq = row * 8 + col
             for ability in piece.abilities:
                 if ability == PieceType.PAWN:
                     direction = -1 if color == Color.WHITE else 1
@@ -806,62 +908,19 @@ class ChessGame:
                                 valid_moves.add((nr, nc))
 
                 elif ability == PieceType.ROOK:
-                    for dr, dc in rook_dirs:
-                        r, c = row+dr, col+dc
-                        while 0 <= r < 8 and 0 <= c < 8:
-                            target = self.get_piece_at(r, c)
-                            if target is None:
-                                valid_moves.add((r,c))
-                            else:
-                                if target.color != color:
-                                    valid_moves.add((r,c))
-                                break
-                            r += dr
-                            c += dc
+                    valid_moves.update(_squares(_rook_attacks(sq, occupied) & ~own))
 
                 elif ability == PieceType.BISHOP:
-                    for dr, dc in bishop_dirs:
-                        r, c = row+dr, col+dc
-                        while 0 <= r < 8 and 0 <= c < 8:
-                            target = self.get_piece_at(r, c)
-                            if target is None:
-                                valid_moves.add((r,c))
-                            else:
-                                if target.color != color:
-                                    valid_moves.add((r,c))
-                                break
-                            r += dr
-                            c += dc
+                    valid_moves.update(_squares(_bishop_attacks(sq, occupied) & ~own))
 
                 elif ability == PieceType.QUEEN:
-                    for dr, dc in queen_dirs:
-                        r, c = row+dr, col+dc
-                        while 0 <= r < 8 and 0 <= c < 8:
-                            target = self.get_piece_at(r, c)
-                            if target is None:
-                                valid_moves.add((r,c))
-                            else:
-                                if target.color != color:
-                                    valid_moves.add((r,c))
-                                break
-                            r += dr
-                            c += dc
+                    valid_moves.update(_squares((_rook_attacks(sq, occupied) | _bishop_attacks(sq, occupied)) & ~own))
 
                 elif ability == PieceType.KNIGHT:
-                    for dr, dc in knight_offsets:
-                        nr, nc = row+dr, col+dc
-                        if 0 <= nr < 8 and 0 <= nc < 8:
-                            target = self.get_piece_at(nr, nc)
-                            if target is None or target.color != color:
-                                valid_moves.add((nr,nc))
+                    valid_moves.update(_squares(_KNIGHT_ATTACKS[sq] & ~own))
 
                 elif ability == PieceType.KING:
-                    for dr, dc in king_offsets:
-                        nr, nc = row+dr, col+dc
-                        if 0 <= nr < 8 and 0 <= nc < 8:
-                            target = self.get_piece_at(nr, nc)
-                            if target is None or target.color != color:
-                                valid_moves.add((nr,nc))
+                    valid_moves.update(_squares(_KING_ATTACKS[sq] & ~own))
                     # Castling
                     for side in [-1,1]:
                         rook_col = 0 if side==-1 else 7
@@ -877,22 +936,33 @@ class ChessGame:
 
             # Filter moves that leave king in check
             legal_moves = []
+            occupancy = self.occupancy
+            from_bit = 1 << (row * 8 + col)
             for to_row, to_col in valid_moves:
+                to_sq = to_row * 8 + to_col
+                to_bit = 1 << to_sq
+                to_pos = _SQUARE_POS[to_sq]
                 captured = self.board[to_row][to_col]
                 self.board[to_row][to_col] = piece
                 self.board[row][col] = None
+                occupancy[color] ^= from_bit | to_bit
+                if captured:
+                    occupancy[captured.color] ^= to_bit
                 orig_pos = piece.position
-                piece.position = (to_row, to_col)
+                piece.position = to_pos
 
-                king_safe = not self._is_king_in_check(color, king_pos)
+                king_safe = not self._is_king_in_check(color, to_pos if piece.type == PieceType.KING else king_pos)
 
                 self.board[row][col] = piece
                 self.board[to_row][to_col] = captured
+                occupancy[color] ^= from_bit | to_bit
+                if captured:
+                    occupancy[captured.color] ^= to_bit
                 piece.position = orig_pos
                 if king_safe:
-                    legal_moves.append((to_row,to_col))
+                    legal_moves.append(to_pos)
 
             if legal_moves:
-                moves[(row,col)] = legal_moves
+                moves[_SQUARE_POS[row * 8 + col]] = legal_moves
 
         return moves
\ No newline at end of file
@@ -0,0 +1,24 @@
+"""JSON encode/decode helpers.
+
+Uses orjson when it is installed and falls back to the stdlib json module.
+dumps() always returns str: the frontend parses text frames, and the
+state tables store TEXT columns.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# orjson.JSONDecodeError subclasses json.JSONDecodeError, so one except clause covers both
+JSONDecodeError = json.JSONDecodeError
+
+if orjson is not None:
+    def dumps(obj) -> str:
+        return orjson.dumps(obj).decode()
+
+    loads = orjson.loads
+else:
+    dumps = json.dumps
+    loads = json.loads
@@ -1,17 +1,17 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import List, Optional, Dict
 import datetime
 import websockets
 from .enums import Color
 
-@dataclass
+@dataclass(slots=True)
 class Player:
     id: str
     name: str
     color: Color
     websocket: websockets.WebSocketServerProtocol
 
-@dataclass 
+@dataclass(slots=True)
 class BotPlayer:
     id: str
     name: str
@@ -22,7 +22,7 @@ class BotPlayer:
         # Ensure bot has a None websocket
         self.websocket = None
 
-@dataclass
+@dataclass(slots=True)
 class Lobby:
     code: str
     owner_id: str
@@ -30,4 +30,19 @@ class Lobby:
     game_state: Optional[Dict]
     settings: Dict
     created_at: datetime.datetime
-    has_bot: bool = False  # Track if lobby contains a bot
\ No newline at end of file
+    has_bot: bool = False  # Track if lobby contains a bot
+    game: Optional['ChessGame'] = None  # Live game matching game_state; never persisted, rebuilt on demand
+    players_by_id: Dict[str, Player] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        self.players_by_id = {p.id: p for p in self.players}
+
+    def add_player(self, player: Player):
+        """Append a player, keeping players_by_id in step"""
+        self.players.append(player)
+        self.players_by_id[player.id] = player
+
+    def remove_player(self, client_id: str):
+        """Drop a player by id, keeping players_by_id in step"""
+        if self.players_by_id.pop(client_id, None) is not None:
+            self.players = [p for p in self.players if p.id != client_id]
\ No newline at end of file
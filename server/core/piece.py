@@ -1,18 +1,51 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import List
 from .enums import PieceType, Color
 
-@dataclass
+# Enum .value goes through a descriptor on every access; serialization looks the strings up here
+_PIECE_TYPE_STR = {pt: pt.value for pt in PieceType}
+
+# PieceType / Color -> the engine's zobrist and MVV-LVA table indices (type 1..6, color 0..1)
+PIECE_TYPE_INDEX = {
+    PieceType.PAWN: 1,
+    PieceType.ROOK: 2,
+    PieceType.KNIGHT: 3,
+    PieceType.BISHOP: 4,
+    PieceType.QUEEN: 5,
+    PieceType.KING: 6
+}
+COLOR_INDEX = {Color.WHITE: 0, Color.BLACK: 1}
+
+@dataclass(slots=True)
 class Piece:
     type: PieceType
     color: Color
     abilities: List[PieceType]  # List of movement abilities this piece has
     position: tuple  # (row, col)
     has_moved: bool = False
+    # Derived, not part of a piece's identity: value strings and table indices,
+    # set in __post_init__ and kept current by set_type
+    type_str: str = field(init=False, repr=False, compare=False)
+    color_str: str = field(init=False, repr=False, compare=False)
+    _pt_idx: int = field(init=False, repr=False, compare=False)
+    _col_idx: int = field(init=False, repr=False, compare=False)
     
     def __post_init__(self):
         if not self.abilities:
             self.abilities = [self.type]  # Start with own movement type
+        # color never changes and type only through set_type, so their strings are cached
+        self.type_str = self.type.value
+        self.color_str = self.color.value
+        self._pt_idx = PIECE_TYPE_INDEX[self.type]
+        self._col_idx = COLOR_INDEX[self.color]
+
+    def set_type(self, piece_type: PieceType):
+        self.type = piece_type
+        self.type_str = piece_type.value
+        self._pt_idx = PIECE_TYPE_INDEX[piece_type]
+
+    def ability_strs(self) -> List[str]:
+        return [_PIECE_TYPE_STR[a] for a in self.abilities]
 
     def add_ability(self, ability: PieceType):
         if ability not in self.abilities:
@@ -25,13 +58,17 @@ class Piece:
     def has_ability(self, ability: PieceType) -> bool:
         return ability in self.abilities
 
+    def to_tuple(self):
+        return (self.type_str, self.color_str, self.ability_strs(), self.position, self.has_moved)
+
     def to_dict(self):
+        type_value, color_value, abilities, position, has_moved = self.to_tuple()
         return {
-            'type': self.type.value,
-            'color': self.color.value,
-            'abilities': [a.value for a in self.abilities],
-            'position': self.position,
-            'has_moved': self.has_moved
+            'type': type_value,
+            'color': color_value,
+            'abilities': abilities,
+            'position': position,
+            'has_moved': has_moved
         }
 
     @staticmethod
@@ -1,24 +1,142 @@
-from typing import Dict, Optional, TYPE_CHECKING
+from typing import Dict, Mapping, Optional, TYPE_CHECKING
+from types import MappingProxyType
+import asyncio
+import contextlib
+import functools
 import websockets
 import datetime
-import json
 import threading
 import sqlite3
+import logging
+from . import jsonutil
 
 if TYPE_CHECKING:
     from .models import Lobby
 
+logger = logging.getLogger(__name__)
+
+# SQL used by GlobalState, defined once here; each connection compiles a statement
+# the first time it runs and reuses it from its statement cache (cached_statements)
+_LOBBY_JOIN = ('SELECT l.lobby_code, l.owner_id, l.game_state, l.settings, l.created_at, m.client_id, m.player_color '
+               'FROM lobbies l LEFT JOIN client_lobby_map m ON m.lobby_code = l.lobby_code ')
+SQL_SELECT_LOBBY = _LOBBY_JOIN + 'WHERE l.lobby_code = ? ORDER BY m.rowid'
+SQL_SELECT_ALL_LOBBIES = _LOBBY_JOIN + 'ORDER BY m.rowid'
+SQL_SELECT_SEARCHING = 'SELECT client_id, name FROM searching_players'
+SQL_ADD_SEARCHING = 'REPLACE INTO searching_players (client_id, name) VALUES (?, ?)'
+SQL_REMOVE_SEARCHING = 'DELETE FROM searching_players WHERE client_id = ?'
+SQL_CLEAR_SEARCHING = 'DELETE FROM searching_players'
+SQL_SET_TIMEOUT = 'REPLACE INTO game_timeouts (client_id, timeout_time) VALUES (?, ?)'
+SQL_GET_TIMEOUT = 'SELECT timeout_time FROM game_timeouts WHERE client_id = ?'
+SQL_REMOVE_TIMEOUT = 'DELETE FROM game_timeouts WHERE client_id = ?'
+SQL_SELECT_CLIENT_STATES = 'SELECT client_id, state_json FROM client_states'
+SQL_SAVE_CLIENT_STATE = 'REPLACE INTO client_states (client_id, state_json) VALUES (?, ?)'
+SQL_REMOVE_CLIENT_STATE = 'DELETE FROM client_states WHERE client_id = ?'
+SQL_SELECT_DRAW_OFFERS = 'SELECT offerer_id, target_id FROM draw_offer_history'
+SQL_ADD_DRAW_OFFER = 'REPLACE INTO draw_offer_history (offerer_id, target_id) VALUES (?, ?)'
+SQL_REMOVE_DRAW_OFFER = 'DELETE FROM draw_offer_history WHERE offerer_id = ? AND target_id = ?'
+SQL_SAVE_LOBBY = 'REPLACE INTO lobbies (lobby_code, owner_id, game_state, settings, created_at) VALUES (?, ?, ?, ?, ?)'
+SQL_REMOVE_LOBBY = 'DELETE FROM lobbies WHERE lobby_code = ?'
+SQL_REMOVE_LOBBY_MEMBERS = 'DELETE FROM client_lobby_map WHERE lobby_code = ?'
+SQL_SELECT_LOBBY_SUMMARY = 'SELECT owner_id, game_state, settings FROM lobbies WHERE lobby_code = ?'
+SQL_LOBBY_EXISTS = 'SELECT 1 FROM lobbies WHERE lobby_code = ?'
+SQL_UPDATE_GAME_STATE = 'UPDATE lobbies SET game_state = ? WHERE lobby_code = ?'
+SQL_UPDATE_OWNER = 'UPDATE lobbies SET owner_id = ? WHERE lobby_code = ?'
+SQL_SELECT_CLIENT_LOBBIES = 'SELECT client_id, lobby_code FROM client_lobby_map'
+SQL_MAP_CLIENT = 'REPLACE INTO client_lobby_map (client_id, lobby_code, player_color) VALUES (?, ?, ?)'
+SQL_UNMAP_CLIENT = 'DELETE FROM client_lobby_map WHERE client_id = ?'
+SQL_UPDATE_PLAYER_COLOR = 'UPDATE client_lobby_map SET player_color = ? WHERE client_id = ?'
+SQL_UPDATE_LOBBY_PLAYER_COLOR = 'UPDATE client_lobby_map SET player_color = ? WHERE client_id = ? AND lobby_code = ?'
+
+
+def _to_unix_ms(moment: datetime.datetime) -> int:
+    """Convert a datetime to integer unix milliseconds for storage"""
+    return int(moment.timestamp() * 1000)
+
+
+@functools.lru_cache(maxsize=1024)
+def _from_unix_ms(value) -> datetime.datetime:
+    """Convert a stored instant back to a datetime.
+
+    Accepts unix milliseconds, plus the ISO strings written by older databases
+    (whose TEXT columns also hand integers back as digit strings). Stored instants
+    never change and datetimes are immutable, so conversions are memoized.
+    """
+    if isinstance(value, str):
+        if not value.isdigit():
+            return datetime.datetime.fromisoformat(value)
+        value = int(value)
+    return datetime.datetime.fromtimestamp(value / 1000)
+
+def _turn_start_ms(value) -> Optional[int]:
+    """Epoch milliseconds for a clock's last_turn_start as older games stored it.
+
+    Accepts epoch ms, epoch seconds, or a naive UTC ISO string; None if unparseable.
+    """
+    if isinstance(value, str):
+        try:
+            moment = datetime.datetime.fromisoformat(value.rstrip('Z'))
+        except ValueError:
+            return None
+        return int(moment.replace(tzinfo=datetime.timezone.utc).timestamp() * 1000)
+    try:
+        timestamp = float(value)
+    except (TypeError, ValueError):
+        return None
+    return int(timestamp if timestamp > 1e12 else timestamp * 1000)
+
+
+def _load_game_state(game_state_json) -> Optional[dict]:
+    """Parse a stored game state, migrating a legacy clock to int epoch ms so moves never reparse it"""
+    if not game_state_json:
+        return None
+    game_state = jsonutil.loads(game_state_json)
+    clock = game_state.get('clock')
+    if clock:
+        last_turn = clock.get('last_turn_start')
+        if last_turn and type(last_turn) is not int:
+            clock['last_turn_start'] = _turn_start_ms(last_turn)
+    return game_state
+
 class GlobalState:
     """Database-backed global state singleton"""
     
     def __init__(self):
         # Only keep things that can't be stored in DB (websockets, runtime state)
         self.connected_clients: Dict[str, websockets.WebSocketServerProtocol] = {}
+        # A broadcast send that hasn't finished after this many seconds closes that peer
+        self.broadcast_send_timeout = 1.0
+        self._closing_websockets: set = set()  # close() tasks for dropped slow peers
         
-        # Initialize SQLite DB
-        self._db_conn = sqlite3.connect('global_state.db', check_same_thread=False)
-        self._db_conn.row_factory = sqlite3.Row
+        # Initialize SQLite DB (one connection per thread, see _db_conn)
+        self._local = threading.local()
         self._init_db()
+
+        # Client states are read on every message, so the dict is canonical and the
+        # DB is only written behind it (see flush_pending_writes)
+        self._client_states: Dict[str, dict] = {}
+        self._dirty_client_states: set = set()
+        self._load_client_states()
+
+        # Draw offers are a small (offerer_id, target_id) set, kept the same way
+        self._draw_offers: set = set()
+        self._dirty_draw_offers: set = set()
+        self._load_draw_offers()
+
+        # Searching players as client_id -> (websocket, name); the DB table is written through
+        self._searching_players: Dict[str, tuple] = {}
+        self._load_searching_players()
+
+        # Lobbies rebuilt by get_lobby, keyed by lobby code. Every writer below drops
+        # or updates the affected entry, so a cached Lobby always matches the DB.
+        self._lobby_cache: Dict[str, 'Lobby'] = {}
+        # Bumped on every invalidation so a lobby built from rows read off-thread
+        # (aget_lobby) isn't cached if a write landed in the meantime
+        self._lobby_generation = 0
+
+        # client_id -> lobby_code, mirroring client_lobby_map (written through); this is
+        # what get_lobby_by_client resolves on every message
+        self._client_lobby: Dict[str, str] = {}
+        self._load_client_lobby_map()
     
     _instance = None
     _lock = threading.Lock()
@@ -31,69 +149,169 @@ class GlobalState:
                     cls._instance = cls()
         return cls._instance
         
+    @property
+    def _db_conn(self) -> sqlite3.Connection:
+        """This thread's DB connection, opened on first use"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # Autocommit mode: transactions are opened explicitly by transaction()
+            conn = sqlite3.connect('global_state.db', isolation_level=None, cached_statements=256)
+            conn.row_factory = sqlite3.Row
+            self._configure_connection(conn)
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _configure_connection(conn: sqlite3.Connection):
+        """Apply journal/cache pragmas; all but journal_mode are per connection"""
+        # WAL lets readers proceed while a write is in progress
+        journal_mode = conn.execute('PRAGMA journal_mode=WAL').fetchone()[0]
+        if journal_mode.lower() != 'wal':
+            logger.warning("[DB] WAL not available, journal_mode is %s", journal_mode)
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute('PRAGMA cache_size=-64000')  # 64 MB
+        conn.execute('PRAGMA mmap_size=268435456')  # 256 MB
+        conn.execute('PRAGMA busy_timeout=5000')
+
     def _init_db(self):
-        cur = self._db_conn.cursor()
+        conn = self._db_conn
         # Lobbies table
-        cur.execute('''CREATE TABLE IF NOT EXISTS lobbies (
+        conn.execute('''CREATE TABLE IF NOT EXISTS lobbies (
             lobby_code TEXT PRIMARY KEY,
             owner_id TEXT,
             game_state TEXT,
             settings TEXT,
-            created_at TEXT
+            created_at INTEGER
         )''')
         # Client-lobby mapping
-        cur.execute('''CREATE TABLE IF NOT EXISTS client_lobby_map (
+        conn.execute('''CREATE TABLE IF NOT EXISTS client_lobby_map (
             client_id TEXT PRIMARY KEY,
             lobby_code TEXT,
             player_color TEXT
         )''')
         # Add player_color column if it doesn't exist (for existing databases)
         try:
-            cur.execute('ALTER TABLE client_lobby_map ADD COLUMN player_color TEXT')
+            conn.execute('ALTER TABLE client_lobby_map ADD COLUMN player_color TEXT')
         except sqlite3.OperationalError:
             # Column already exists
             pass
+        # Lobby membership is looked up by lobby_code (get_lobby, get_all_lobbies, remove_lobby);
+        # carrying player_color and client_id makes the index covering for those joins
+        conn.execute('DROP INDEX IF EXISTS idx_clm_lobby')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_clm_lobby_cover ON client_lobby_map(lobby_code, player_color, client_id)')
         # Searching players
-        cur.execute('''CREATE TABLE IF NOT EXISTS searching_players (
+        conn.execute('''CREATE TABLE IF NOT EXISTS searching_players (
             client_id TEXT PRIMARY KEY,
             name TEXT
         )''')
         # Draw offer history
-        cur.execute('''CREATE TABLE IF NOT EXISTS draw_offer_history (
+        conn.execute('''CREATE TABLE IF NOT EXISTS draw_offer_history (
             offerer_id TEXT,
             target_id TEXT,
             PRIMARY KEY (offerer_id, target_id)
         )''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_draw_target ON draw_offer_history(target_id)')
         # Game timeouts
-        cur.execute('''CREATE TABLE IF NOT EXISTS game_timeouts (
+        conn.execute('''CREATE TABLE IF NOT EXISTS game_timeouts (
             client_id TEXT PRIMARY KEY,
-            timeout_time TEXT
+            timeout_time INTEGER
         )''')
         # Client states
-        cur.execute('''CREATE TABLE IF NOT EXISTS client_states (
+        conn.execute('''CREATE TABLE IF NOT EXISTS client_states (
             client_id TEXT PRIMARY KEY,
             state_json TEXT
         )''')
-        self._db_conn.commit()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Run the enclosed writes as one BEGIN IMMEDIATE ... COMMIT on this thread's connection.
+
+        Nested uses join the outermost transaction, so public write methods can be
+        grouped by a caller into a single commit. In-memory mirror updates queued with
+        _after_commit run once that commit succeeds and are dropped on rollback.
+        """
+        conn = self._db_conn
+        if conn.in_transaction:
+            yield conn
+            return
+        conn.execute('BEGIN IMMEDIATE')
+        self._local.after_commit = after_commit = []
+        try:
+            yield conn
+            conn.execute('COMMIT')
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            # Cached lobbies may hold reads or patches from the rolled-back writes
+            self._invalidate_lobby()
+            raise
+        finally:
+            self._local.after_commit = None
+        for callback, args in after_commit:
+            callback(*args)
+
+    def _after_commit(self, callback, *args):
+        """Call callback(*args) now, or after the outermost COMMIT when inside a transaction"""
+        pending = getattr(self._local, 'after_commit', None)
+        if pending is None:
+            callback(*args)
+        else:
+            pending.append((callback, args))
+
+    def _invalidate_lobby(self, lobby_code: str = None):
+        """Drop a cached lobby, or every cached lobby when the affected one isn't known"""
+        self._lobby_generation += 1
+        if lobby_code is None:
+            self._lobby_cache.clear()
+        else:
+            self._lobby_cache.pop(lobby_code, None)
+
+    def _invalidate_client_lobby(self, client_id: str):
+        """Drop the cached lobby a client belongs to (its player list depends on the client)"""
+        lobby_code = self._client_lobby.get(client_id)
+        if lobby_code is not None:
+            self._invalidate_lobby(lobby_code)
+
+    def _map_client_lobby(self, client_id: str, lobby_code: Optional[str]):
+        """Point a client's in-memory lobby mapping at lobby_code, or drop it when None"""
+        # The client may have been mapped to another lobby before
+        self._invalidate_client_lobby(client_id)
+        if lobby_code is None:
+            self._client_lobby.pop(client_id, None)
+        else:
+            self._client_lobby[client_id] = lobby_code
+            self._invalidate_lobby(lobby_code)
+
+    def _unmap_lobby(self, lobby_code: str):
+        """Drop every in-memory client mapping to a removed lobby"""
+        for client_id in [c for c, code in self._client_lobby.items() if code == lobby_code]:
+            del self._client_lobby[client_id]
+        self._invalidate_lobby(lobby_code)
 
     # ===== CLIENT CONNECTION METHODS (Memory-based for websockets) =====
     def register_client(self, client_id: str, websocket: websockets.WebSocketServerProtocol):
         """Register a new client connection"""
         self.connected_clients[client_id] = websocket
-        self.update_client_state(client_id, 'idle')
+        # Same as update_client_state(client_id, 'idle'); the write is coalesced into the
+        # next flush_pending_writes, so a reconnect storm costs one transaction, not one per socket
+        self._client_states[client_id] = {'status': 'idle'}
+        self._dirty_client_states.add(client_id)
+        self._invalidate_client_lobby(client_id)
 
     def unregister_client(self, client_id: str, remove_from_lobby: bool = True):
         """Remove a client when they disconnect"""
-        if remove_from_lobby:
-            # Full cleanup - remove from everything
-            if client_id in self.connected_clients:
-                del self.connected_clients[client_id]
-            self.remove_player_from_lobby(client_id)
-            self.remove_client_state(client_id)
-        else:
-            # Partial cleanup - only remove from searching (keep in connected_clients for auto-resign)
-            pass
-        self.remove_searching_player(client_id)
+        with self.transaction():
+            if remove_from_lobby:
+                # Full cleanup - remove from everything
+                self.connected_clients.pop(client_id, None)
+                self._invalidate_client_lobby(client_id)
+                self.remove_player_from_lobby(client_id)
+                self.remove_client_state(client_id)
+            else:
+                # Partial cleanup - only remove from searching (keep in connected_clients for auto-resign)
+                pass
+            self.remove_searching_player(client_id)
 
     def get_client_websocket(self, client_id: str) -> Optional[websockets.WebSocketServerProtocol]:
         """Get the websocket for a connected client"""
@@ -103,339 +321,417 @@ class GlobalState:
         """Check if a client is connected"""
         return client_id in self.connected_clients
 
+    def detach_client_websocket(self, client_id: str) -> Optional[websockets.WebSocketServerProtocol]:
+        """Drop a client's websocket but keep its entry (auto-resign still needs it); returns the old websocket"""
+        if client_id not in self.connected_clients:
+            return None
+        websocket = self.connected_clients[client_id]
+        self.connected_clients[client_id] = None
+        self._invalidate_client_lobby(client_id)
+        return websocket
+
+    def forget_client(self, client_id: str):
+        """Remove a client's connection entry entirely"""
+        self.connected_clients.pop(client_id, None)
+        self._invalidate_client_lobby(client_id)
+
     async def broadcast_to_clients(self, message: dict, exclude_client_id: str = None):
         """Send a message to all connected clients except the excluded one"""
-        for client_id, websocket in list(self.connected_clients.items()):
-            if client_id != exclude_client_id:
-                try:
-                    await websocket.send(json.dumps(message))
-                except websockets.exceptions.ConnectionClosed:
-                    pass
-
-    # ===== SEARCHING PLAYERS METHODS (DB-based) =====
+        payload = jsonutil.dumps(message)
+        # Sends run concurrently so one slow peer doesn't hold up everyone after it
+        recipients = [(client_id, websocket) for client_id, websocket in self.connected_clients.items()
+                      if client_id != exclude_client_id and websocket is not None]
+        await self.send_to_clients(recipients, payload)
+
+    async def send_to_clients(self, recipients: list, payload: str):
+        """Send an encoded payload to (client_id, websocket) pairs concurrently.
+
+        A failed send is logged and doesn't affect the others; a peer that stalls is closed.
+        """
+        results = await asyncio.gather(*(self._send_or_drop(client_id, websocket, payload) for client_id, websocket in recipients),
+                                       return_exceptions=True)
+        for (client_id, _), result in zip(recipients, results):
+            if isinstance(result, Exception) and not isinstance(result, websockets.exceptions.ConnectionClosed):
+                logger.warning("[BROADCAST] Failed to send to client %s: %s", client_id, result)
+
+    async def _send_or_drop(self, client_id: str, websocket: websockets.WebSocketServerProtocol, payload: str):
+        """Send one broadcast payload; close the connection if the peer can't take it in time"""
+        try:
+            await asyncio.wait_for(websocket.send(payload), self.broadcast_send_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("[BROADCAST] Client %s did not accept a send within %ss, closing it", client_id, self.broadcast_send_timeout)
+            # Closing ends the client's handler loop, which runs the normal disconnect
+            # path (auto-resign grace period included); don't wait for the handshake here
+            task = asyncio.create_task(websocket.close())
+            self._closing_websockets.add(task)
+            task.add_done_callback(self._closing_websockets.discard)
+
+    # ===== SEARCHING PLAYERS METHODS (Memory-based, written through to DB) =====
+    def _load_searching_players(self):
+        """Load persisted searching players into memory (their websockets are gone after a restart)"""
+        for row in self._db_conn.execute(SQL_SELECT_SEARCHING):
+            self._searching_players[row['client_id']] = (self.connected_clients.get(row['client_id']), row['name'])
+
     def add_searching_player(self, client_id: str, websocket: websockets.WebSocketServerProtocol, name: str):
         """Add a player to the searching list"""
         # Store websocket in memory
         self.connected_clients[client_id] = websocket
+        self._invalidate_client_lobby(client_id)
+        self._searching_players[client_id] = (websocket, name)
         # Store search data in DB
-        cur = self._db_conn.cursor()
-        cur.execute('REPLACE INTO searching_players (client_id, name) VALUES (?, ?)', (client_id, name))
-        self._db_conn.commit()
+        with self.transaction() as conn:
+            conn.execute(SQL_ADD_SEARCHING, (client_id, name))
 
     def remove_searching_player(self, client_id: str):
         """Remove a player from the searching list"""
-        cur = self._db_conn.cursor()
-        cur.execute('DELETE FROM searching_players WHERE client_id = ?', (client_id,))
-        self._db_conn.commit()
-
-    def get_searching_players(self) -> Dict[str, tuple]:
-        """Get all searching players"""
-        cur = self._db_conn.cursor()
-        cur.execute('SELECT client_id, name FROM searching_players')
-        rows = cur.fetchall()
-        result = {}
-        for row in rows:
-            # Return (websocket, name) tuple - websocket from memory, name from DB
-            websocket = self.connected_clients.get(row['client_id'])
-            result[row['client_id']] = (websocket, row['name'])
-        return result
+        if client_id not in self._searching_players:
+            return
+        with self.transaction() as conn:
+            conn.execute(SQL_REMOVE_SEARCHING, (client_id,))
+        self._after_commit(self._searching_players.pop, client_id, None)
+
+    def get_searching_players(self) -> Mapping[str, tuple]:
+        """Get a read-only view of all searching players as client_id -> (websocket, name)"""
+        return MappingProxyType(self._searching_players)
 
     def clear_searching_players(self):
         """Clear all searching players"""
-        cur = self._db_conn.cursor()
-        cur.execute('DELETE FROM searching_players')
-        self._db_conn.commit()
+        self._searching_players.clear()
+        with self.transaction() as conn:
+            conn.execute(SQL_CLEAR_SEARCHING)
 
     # ===== GAME TIMEOUT METHODS (DB-based) =====
     def set_game_timeout(self, client_id: str, timeout_time: datetime.datetime):
         """Set game timeout for a client"""
-        cur = self._db_conn.cursor()
-        cur.execute('REPLACE INTO game_timeouts (client_id, timeout_time) VALUES (?, ?)', (client_id, timeout_time.isoformat()))
-        self._db_conn.commit()
+        with self.transaction() as conn:
+            conn.execute(SQL_SET_TIMEOUT, (client_id, _to_unix_ms(timeout_time)))
 
     def get_game_timeout(self, client_id: str) -> Optional[datetime.datetime]:
         """Get game timeout for a client"""
-        cur = self._db_conn.cursor()
-        cur.execute('SELECT timeout_time FROM game_timeouts WHERE client_id = ?', (client_id,))
-        row = cur.fetchone()
+        row = self._db_conn.execute(SQL_GET_TIMEOUT, (client_id,)).fetchone()
         if row:
-            return datetime.datetime.fromisoformat(row['timeout_time'])
+            return _from_unix_ms(row['timeout_time'])
         return None
 
     def remove_game_timeout(self, client_id: str):
         """Remove game timeout for a client"""
-        cur = self._db_conn.cursor()
-        cur.execute('DELETE FROM game_timeouts WHERE client_id = ?', (client_id,))
-        self._db_conn.commit()
+        with self.transaction() as conn:
+            conn.execute(SQL_REMOVE_TIMEOUT, (client_id,))
+
+    # ===== CLIENT STATE METHODS (Memory-based, written behind to DB) =====
+    def _load_client_states(self):
+        """Load persisted client states into memory"""
+        for row in self._db_conn.execute(SQL_SELECT_CLIENT_STATES):
+            self._client_states[row['client_id']] = jsonutil.loads(row['state_json'])
 
-    # ===== CLIENT STATE METHODS (DB-based) =====
     def update_client_state(self, client_id: str, status: str, **kwargs):
         """Update a client's state"""
         state = {'status': status}
         state.update(kwargs)
-        cur = self._db_conn.cursor()
-        cur.execute('REPLACE INTO client_states (client_id, state_json) VALUES (?, ?)', (client_id, json.dumps(state)))
-        self._db_conn.commit()
+        self._client_states[client_id] = state
+        self._dirty_client_states.add(client_id)
+        self._invalidate_client_lobby(client_id)
 
     def get_client_state(self, client_id: str) -> Optional[dict]:
         """Get the current state of a client"""
-        cur = self._db_conn.cursor()
-        cur.execute('SELECT state_json FROM client_states WHERE client_id = ?', (client_id,))
-        row = cur.fetchone()
-        if row:
-            return json.loads(row['state_json'])
-        return None
+        return self._client_states.get(client_id)
 
     def remove_client_state(self, client_id: str):
         """Remove client state"""
-        cur = self._db_conn.cursor()
-        cur.execute('DELETE FROM client_states WHERE client_id = ?', (client_id,))
-        self._db_conn.commit()
+        self._client_states.pop(client_id, None)
+        self._dirty_client_states.add(client_id)
+        self._invalidate_client_lobby(client_id)
+
+    def flush_pending_writes(self):
+        """Persist in-memory state (client states, draw offers) that changed since the last flush"""
+        if not self._dirty_client_states and not self._dirty_draw_offers:
+            return
+        dirty_states, self._dirty_client_states = self._dirty_client_states, set()
+        dirty_offers, self._dirty_draw_offers = self._dirty_draw_offers, set()
+        saved_states, removed_states = [], []
+        for client_id in dirty_states:
+            state = self._client_states.get(client_id)
+            if state is None:
+                removed_states.append((client_id,))
+            else:
+                saved_states.append((client_id, jsonutil.dumps(state)))
+        added_offers = [offer for offer in dirty_offers if offer in self._draw_offers]
+        removed_offers = [offer for offer in dirty_offers if offer not in self._draw_offers]
+        try:
+            with self.transaction() as conn:
+                conn.executemany(SQL_SAVE_CLIENT_STATE, saved_states)
+                conn.executemany(SQL_REMOVE_CLIENT_STATE, removed_states)
+                conn.executemany(SQL_ADD_DRAW_OFFER, added_offers)
+                conn.executemany(SQL_REMOVE_DRAW_OFFER, removed_offers)
+        except Exception:
+            # Nothing was written; keep the entries dirty so the next flush retries them
+            self._dirty_client_states |= dirty_states
+            self._dirty_draw_offers |= dirty_offers
+            raise
+
+    # ===== DRAW OFFER METHODS (Memory-based, written behind to DB) =====
+    def _load_draw_offers(self):
+        """Load persisted draw offers into memory"""
+        rows = self._db_conn.execute(SQL_SELECT_DRAW_OFFERS)
+        self._draw_offers.update((row['offerer_id'], row['target_id']) for row in rows)
 
-    # ===== DRAW OFFER METHODS (DB-based) =====
     def add_draw_offer(self, offerer_id: str, target_id: str):
         """Add a draw offer"""
-        cur = self._db_conn.cursor()
-        cur.execute('REPLACE INTO draw_offer_history (offerer_id, target_id) VALUES (?, ?)', (offerer_id, target_id))
-        self._db_conn.commit()
+        offer = (offerer_id, target_id)
+        self._draw_offers.add(offer)
+        self._dirty_draw_offers.add(offer)
 
     def has_draw_offer(self, offerer_id: str, target_id: str) -> bool:
         """Check if a draw offer exists"""
-        cur = self._db_conn.cursor()
-        cur.execute('SELECT 1 FROM draw_offer_history WHERE offerer_id = ? AND target_id = ?', (offerer_id, target_id))
-        return cur.fetchone() is not None
+        return (offerer_id, target_id) in self._draw_offers
 
     def remove_draw_offer(self, offerer_id: str, target_id: str):
         """Remove a draw offer"""
-        cur = self._db_conn.cursor()
-        cur.execute('DELETE FROM draw_offer_history WHERE offerer_id = ? AND target_id = ?', (offerer_id, target_id))
-        self._db_conn.commit()
+        offer = (offerer_id, target_id)
+        self._draw_offers.discard(offer)
+        self._dirty_draw_offers.add(offer)
 
     # ===== LOBBY MANAGEMENT METHODS (DB-based) =====
     def add_lobby(self, lobby_code: str, lobby: 'Lobby'):
         """Add a lobby to the global state and DB"""
         # Serialize game_state and settings
-        game_state_json = json.dumps(lobby.game_state) if lobby.game_state else None
-        settings_json = json.dumps(lobby.settings) if hasattr(lobby, 'settings') else None
-        created_at_iso = lobby.created_at.isoformat() if hasattr(lobby, 'created_at') and lobby.created_at else datetime.datetime.now().isoformat()
-        cur = self._db_conn.cursor()
-        cur.execute('REPLACE INTO lobbies (lobby_code, owner_id, game_state, settings, created_at) VALUES (?, ?, ?, ?, ?)',
-                    (lobby_code, lobby.owner_id, game_state_json, settings_json, created_at_iso))
-        self._db_conn.commit()
-        # Map the owner to this lobby in DB with their color
+        game_state_json = jsonutil.dumps(lobby.game_state) if lobby.game_state else None
+        settings_json = jsonutil.dumps(lobby.settings)
+        created_at_ms = _to_unix_ms(lobby.created_at or datetime.datetime.now())
+        # The lobby row and the owner's mapping go in one transaction
+        with self.transaction() as conn:
+            conn.execute(SQL_SAVE_LOBBY,
+                         (lobby_code, lobby.owner_id, game_state_json, settings_json, created_at_ms))
+            # Map the owner to this lobby in DB with their color
+            if lobby.owner_id and lobby.players:
+                # Find the owner player to get their color
+                owner_player = lobby.players_by_id.get(lobby.owner_id)
+                owner_color = owner_player.color.value if owner_player else 'white'
+                conn.execute(SQL_MAP_CLIENT, (lobby.owner_id, lobby_code, owner_color))
         if lobby.owner_id and lobby.players:
-            # Find the owner player to get their color
-            owner_player = next((p for p in lobby.players if p.id == lobby.owner_id), None)
-            owner_color = owner_player.color.value if owner_player else 'white'
-            self.add_player_to_lobby(lobby.owner_id, lobby_code, owner_color)
+            self._after_commit(self._map_client_lobby, lobby.owner_id, lobby_code)
+        self._invalidate_lobby(lobby_code)
 
     def remove_lobby(self, lobby_code: str):
         """Remove a lobby and update client mappings in DB"""
-        # Get lobby details from DB first
-        cur = self._db_conn.cursor()
-        cur.execute('SELECT * FROM lobbies WHERE lobby_code = ?', (lobby_code,))
-        lobby_row = cur.fetchone()
-        if lobby_row:
+        with self.transaction() as conn:
             # Remove all players from client_lobby_map (DB)
-            cur.execute('DELETE FROM client_lobby_map WHERE lobby_code = ?', (lobby_code,))
-            cur.execute('DELETE FROM lobbies WHERE lobby_code = ?', (lobby_code,))
-            self._db_conn.commit()
+            conn.execute(SQL_REMOVE_LOBBY_MEMBERS, (lobby_code,))
+            conn.execute(SQL_REMOVE_LOBBY, (lobby_code,))
+        self._after_commit(self._unmap_lobby, lobby_code)
 
-    def get_lobby(self, lobby_code: str) -> Optional['Lobby']:
-        """Get a lobby by its code from DB and reconstruct players from client mappings"""
-        cur = self._db_conn.cursor()
-        cur.execute('SELECT * FROM lobbies WHERE lobby_code = ?', (lobby_code,))
-        row = cur.fetchone()
-        if row:
-            from server.core.models import Lobby, Player, BotPlayer
-            from server.core.enums import Color
-            
-            game_state = json.loads(row['game_state']) if row['game_state'] else None
-            settings = json.loads(row['settings']) if row['settings'] else {}
-            created_at = row['created_at'] if 'created_at' in row.keys() and row['created_at'] else None
-            if created_at:
-                created_at = datetime.datetime.fromisoformat(created_at)
+    def _build_lobby(self, rows: list, include_disconnected: bool) -> 'Lobby':
+        """Build a Lobby from its lobbies LEFT JOIN client_lobby_map rows (one per mapped client)"""
+        from server.core.models import Lobby, Player, BotPlayer
+        from server.core.enums import Color
+
+        row = rows[0]
+        game_state = _load_game_state(row['game_state'])
+        settings = jsonutil.loads(row['settings']) if row['settings'] else {}
+        created_at = _from_unix_ms(row['created_at']) if row['created_at'] else datetime.datetime.now()
+
+        # Reconstruct players list from client_lobby_map and connected_clients
+        players = []
+        has_bot = False
+        for client_row in rows:
+            client_id = client_row['client_id']
+            if client_id is None:
+                # Lobby with no mapped clients
+                continue
+            stored_color = client_row['player_color']
+
+            # Check if this is a bot player
+            is_bot = client_id.startswith('bot_')
+
+            # get_lobby only includes connected clients (and bots); get_all_lobbies includes everyone
+            if not (include_disconnected or is_bot or client_id in self.connected_clients):
+                continue
+
+            # Use stored color if available, otherwise fall back to position-based assignment
+            if stored_color:
+                player_color = Color.WHITE if stored_color == 'white' else Color.BLACK
             else:
-                created_at = datetime.datetime.now()
-            
-            # Reconstruct players list from client_lobby_map and connected_clients
-            players = []
-            cur.execute('SELECT client_id, player_color FROM client_lobby_map WHERE lobby_code = ?', (lobby_code,))
-            client_rows = cur.fetchall()
-            
-            for client_row in client_rows:
-                client_id = client_row['client_id']
-                stored_color = client_row['player_color']
-                websocket = self.connected_clients.get(client_id)
-                
-                # Check if this is a bot player
-                is_bot = client_id.startswith('bot_')
-                
-                # Include clients if they're connected OR if they're bots
-                if client_id in self.connected_clients or is_bot:
-                    # Get client state to find player name
-                    client_state = self.get_client_state(client_id)
-                    if is_bot:
-                        # For bots, use default name and no websocket
-                        player_name = 'Chess Bot'
-                        websocket = None
-                        from server.core.models import BotPlayer
-                        # Use stored color if available, otherwise fall back to position-based assignment
-                        if stored_color:
-                            player_color = Color.WHITE if stored_color == 'white' else Color.BLACK
-                        else:
-                            # Fallback for legacy data without stored colors
-                            player_color = Color.WHITE if len(players) == 0 else Color.BLACK
-                        
-                        player = BotPlayer(client_id, player_name, player_color)
-                    else:
-                        # For human players
-                        player_name = client_state.get('player_name', 'Player') if client_state else 'Player'
-                        
-                        # Use stored color if available, otherwise fall back to position-based assignment
-                        if stored_color:
-                            player_color = Color.WHITE if stored_color == 'white' else Color.BLACK
-                        else:
-                            # Fallback for legacy data without stored colors
-                            player_color = Color.WHITE if len(players) == 0 else Color.BLACK
-                        
-                        player = Player(client_id, player_name, player_color, websocket)
-                    
-                    players.append(player)
-            
-            # Determine if lobby has a bot by checking if any player is a BotPlayer
-            has_bot = any(isinstance(player, BotPlayer) for player in players)
-            
-            lobby = Lobby(code=row['lobby_code'], owner_id=row['owner_id'], players=players, game_state=game_state, settings=settings, created_at=created_at, has_bot=has_bot)
+                # Fallback for legacy data without stored colors
+                player_color = Color.WHITE if len(players) == 0 else Color.BLACK
+
+            if is_bot:
+                # For bots, use default name and no websocket
+                player = BotPlayer(client_id, 'Chess Bot', player_color)
+                has_bot = True
+            else:
+                # For human players, the name comes from their client state
+                client_state = self.get_client_state(client_id)
+                player_name = client_state.get('player_name', 'Player') if client_state else 'Player'
+                player = Player(client_id, player_name, player_color, self.connected_clients.get(client_id))
+
+            players.append(player)
+
+        return Lobby(code=row['lobby_code'], owner_id=row['owner_id'], players=players, game_state=game_state, settings=settings, created_at=created_at, has_bot=has_bot)
+
+    def _fetch_lobby_rows(self, lobby_code: str) -> list:
+        """Joined lobbies/client_lobby_map rows for one lobby"""
+        return self._db_conn.execute(SQL_SELECT_LOBBY, (lobby_code,)).fetchall()
+
+    def get_lobby(self, lobby_code: str) -> Optional['Lobby']:
+        """Get a lobby by its code, rebuilding it from DB and client mappings on a cache miss"""
+        lobby = self._lobby_cache.get(lobby_code)
+        if lobby is not None:
             return lobby
-        return None
+        rows = self._fetch_lobby_rows(lobby_code)
+        if not rows:
+            return None
+        lobby = self._build_lobby(rows, include_disconnected=False)
+        self._lobby_cache[lobby_code] = lobby
+        return lobby
 
     def get_lobby_by_client(self, client_id: str) -> Optional['Lobby']:
-        """Get the lobby that a client is currently in from DB"""
-        cur = self._db_conn.cursor()
-        cur.execute('SELECT lobby_code FROM client_lobby_map WHERE client_id = ?', (client_id,))
-        row = cur.fetchone()
-        if row:
-            lobby_code = row['lobby_code']
+        """Get the lobby that a client is currently in"""
+        lobby_code = self._client_lobby.get(client_id)
+        if lobby_code:
             return self.get_lobby(lobby_code)
         return None
 
+    def _load_client_lobby_map(self):
+        """Load persisted client -> lobby mappings into memory"""
+        for row in self._db_conn.execute(SQL_SELECT_CLIENT_LOBBIES):
+            self._client_lobby[row['client_id']] = row['lobby_code']
+
+    def get_lobby_code_by_client(self, client_id: str) -> Optional[str]:
+        """Get the code of the lobby a client is mapped to"""
+        return self._client_lobby.get(client_id)
+
     def add_player_to_lobby(self, client_id: str, lobby_code: str, player_color: str = None):
         """Map a client to a lobby in DB with their color"""
-        cur = self._db_conn.cursor()
-        cur.execute('REPLACE INTO client_lobby_map (client_id, lobby_code, player_color) VALUES (?, ?, ?)', (client_id, lobby_code, player_color))
-        self._db_conn.commit()
+        with self.transaction() as conn:
+            conn.execute(SQL_MAP_CLIENT, (client_id, lobby_code, player_color))
+        self._after_commit(self._map_client_lobby, client_id, lobby_code)
 
     def remove_player_from_lobby(self, client_id: str):
         """Remove client's lobby mapping from DB"""
-        cur = self._db_conn.cursor()
-        cur.execute('DELETE FROM client_lobby_map WHERE client_id = ?', (client_id,))
-        self._db_conn.commit()
+        if client_id not in self._client_lobby:
+            return
+        with self.transaction() as conn:
+            conn.execute(SQL_UNMAP_CLIENT, (client_id,))
+        self._after_commit(self._map_client_lobby, client_id, None)
+
+    def _fetch_all_lobby_rows(self) -> Dict[str, list]:
+        """Joined lobbies/client_lobby_map rows grouped by lobby code"""
+        rows = self._db_conn.execute(SQL_SELECT_ALL_LOBBIES)
+        # Group the joined rows by lobby, keeping the map's row order (join order) for players
+        rows_by_lobby: Dict[str, list] = {}
+        for row in rows:
+            rows_by_lobby.setdefault(row['lobby_code'], []).append(row)
+        return rows_by_lobby
 
     def get_all_lobbies(self) -> Dict[str, 'Lobby']:
         """Get all lobbies from DB and reconstruct players"""
-        cur = self._db_conn.cursor()
-        cur.execute('SELECT * FROM lobbies')
-        rows = cur.fetchall()
-        lobbies = {}
-        from server.core.models import Lobby, Player, BotPlayer
-        from server.core.enums import Color
-        
-        for row in rows:
-            game_state = json.loads(row['game_state']) if row['game_state'] else None
-            settings = json.loads(row['settings']) if row['settings'] else {}
-            created_at = row['created_at'] if 'created_at' in row.keys() and row['created_at'] else None
-            if created_at:
-                created_at = datetime.datetime.fromisoformat(created_at)
-            else:
-                created_at = datetime.datetime.now()
-            
-            lobby_code = row['lobby_code']
-            
-            # Reconstruct players list from client_lobby_map and connected_clients
-            players = []
-            cur2 = self._db_conn.cursor()
-            cur2.execute('SELECT client_id, player_color FROM client_lobby_map WHERE lobby_code = ?', (lobby_code,))
-            client_rows = cur2.fetchall()
-            
-            for client_row in client_rows:
-                client_id = client_row['client_id']
-                stored_color = client_row['player_color']
-                websocket = self.connected_clients.get(client_id)
-                
-                # Check if this is a bot player
-                is_bot = client_id.startswith('bot_')
-                
-                if is_bot:
-                    # For bots, use default name and no websocket
-                    player_name = 'Chess Bot'
-                    websocket = None
-                    from server.core.models import BotPlayer
-                    # Use stored color if available, otherwise fall back to position-based assignment
-                    if stored_color:
-                        player_color = Color.WHITE if stored_color == 'white' else Color.BLACK
-                    else:
-                        # Fallback for legacy data without stored colors
-                        player_color = Color.WHITE if len(players) == 0 else Color.BLACK
-                    
-                    player = BotPlayer(client_id, player_name, player_color)
-                else:
-                    # For human players
-                    # Include all clients in the lobby, regardless of connection status
-                    # Get client state to find player name
-                    client_state = self.get_client_state(client_id)
-                    player_name = client_state.get('player_name', 'Player') if client_state else 'Player'
-                    
-                    # Use stored color if available, otherwise fall back to position-based assignment
-                    if stored_color:
-                        player_color = Color.WHITE if stored_color == 'white' else Color.BLACK
-                    else:
-                        # Fallback for legacy data without stored colors
-                        player_color = Color.WHITE if len(players) == 0 else Color.BLACK
-                    
-                    player = Player(client_id, player_name, player_color, websocket)
-                
-                players.append(player)
-            
-            # Determine if lobby has a bot by checking if any player is a BotPlayer
-            has_bot = any(isinstance(player, BotPlayer) for player in players)
-            
-            lobby = Lobby(code=lobby_code, owner_id=row['owner_id'], players=players, game_state=game_state, settings=settings, created_at=created_at, has_bot=has_bot)
-            lobbies[lobby_code] = lobby
-        return lobbies
+        rows_by_lobby = self._fetch_all_lobby_rows()
+        return {code: self._build_lobby(rows, include_disconnected=True) for code, rows in rows_by_lobby.items()}
+
+    # ===== ASYNC LOBBY READS (DB queries run in a worker thread) =====
+    # Only the SQLite reads leave the event loop; the Lobby objects are built and
+    # cached back on the loop, where every other cache write happens.
+    async def aget_lobby(self, lobby_code: str) -> Optional['Lobby']:
+        """get_lobby without blocking the event loop on a cache miss"""
+        lobby = self._lobby_cache.get(lobby_code)
+        if lobby is not None:
+            return lobby
+        generation = self._lobby_generation
+        rows = await asyncio.to_thread(self._fetch_lobby_rows, lobby_code)
+        if not rows:
+            return None
+        lobby = self._build_lobby(rows, include_disconnected=False)
+        if generation == self._lobby_generation:
+            self._lobby_cache[lobby_code] = lobby
+        return lobby
+
+    async def aget_lobby_by_client(self, client_id: str) -> Optional['Lobby']:
+        """get_lobby_by_client without blocking the event loop"""
+        lobby_code = self._client_lobby.get(client_id)
+        if lobby_code:
+            return await self.aget_lobby(lobby_code)
+        return None
+
+    async def aget_all_lobbies(self) -> Dict[str, 'Lobby']:
+        """get_all_lobbies without blocking the event loop"""
+        rows_by_lobby = await asyncio.to_thread(self._fetch_all_lobby_rows)
+        return {code: self._build_lobby(rows, include_disconnected=True) for code, rows in rows_by_lobby.items()}
+
+    def get_lobby_summary(self, lobby_code: str) -> Optional[dict]:
+        """Get a lobby's own fields (owner_id, game_state, settings) without reconstructing its players"""
+        lobby = self._lobby_cache.get(lobby_code)
+        if lobby is not None:
+            return {'code': lobby.code, 'owner_id': lobby.owner_id, 'game_state': lobby.game_state, 'settings': lobby.settings}
+        row = self._db_conn.execute(SQL_SELECT_LOBBY_SUMMARY, (lobby_code,)).fetchone()
+        if row is None:
+            return None
+        return {
+            'code': lobby_code,
+            'owner_id': row['owner_id'],
+            'game_state': _load_game_state(row['game_state']),
+            'settings': jsonutil.loads(row['settings']) if row['settings'] else {}
+        }
 
     def lobby_exists(self, lobby_code: str) -> bool:
         """Check if a lobby exists in DB"""
-        cur = self._db_conn.cursor()
-        cur.execute('SELECT 1 FROM lobbies WHERE lobby_code = ?', (lobby_code,))
-        return cur.fetchone() is not None
-
-    def update_lobby_game_state(self, lobby_code: str, game_state: dict):
-        """Update lobby game state in DB"""
-        print(f"[DB] Updating lobby {lobby_code} game state, game_over = {game_state.get('game_over')}")
-        cur = self._db_conn.cursor()
-        game_state_json = json.dumps(game_state) if game_state else None
-        cur.execute('UPDATE lobbies SET game_state = ? WHERE lobby_code = ?', (game_state_json, lobby_code))
-        rows_affected = cur.rowcount
-        self._db_conn.commit()
-        print(f"[DB] Update completed for lobby {lobby_code}, rows affected: {rows_affected}")
+        return self._db_conn.execute(SQL_LOBBY_EXISTS, (lobby_code,)).fetchone() is not None
+
+    def update_lobby_game_state(self, lobby_code: str, game_state: dict, game=None):
+        """Update lobby game state in DB.
+
+        game is the live ChessGame game_state was produced from; without it the
+        cached lobby's game is dropped and rebuilt from game_state when next needed.
+        """
+        logger.debug("[DB] Updating lobby %s game state, game_over = %s", lobby_code, game_state.get('game_over'))
+        game_state_json = jsonutil.dumps(game_state) if game_state else None
+        with self.transaction() as conn:
+            rows_affected = conn.execute(SQL_UPDATE_GAME_STATE, (game_state_json, lobby_code)).rowcount
+        # Write through: only the game changed, so the cached players stay valid
+        self._lobby_generation += 1
+        lobby = self._lobby_cache.get(lobby_code)
+        if lobby is not None:
+            lobby.game_state = game_state
+            lobby.game = game
+        logger.debug("[DB] Update completed for lobby %s, rows affected: %s", lobby_code, rows_affected)
+
+    def update_lobby_game_fields(self, lobby_code: str, fields: dict):
+        """Update top-level game_state fields in place with json_set instead of rewriting the whole state"""
+        if not fields:
+            return
+        # Keys become JSON paths, so only plain top-level names are accepted
+        for key in fields:
+            if not key.isidentifier():
+                raise ValueError(f"Invalid game_state field name: {key!r}")
+        # Paths and values are both bound; json(?) makes SQLite store each value as JSON
+        # (objects, booleans, null) rather than text
+        sql = ('UPDATE lobbies SET game_state = json_set(game_state' + ', ?, json(?)' * len(fields) +
+               ') WHERE lobby_code = ? AND game_state IS NOT NULL')
+        params = []
+        for key, value in fields.items():
+            params += ('$.' + key, jsonutil.dumps(value))
+        with self.transaction() as conn:
+            conn.execute(sql, (*params, lobby_code))
+        self._invalidate_lobby(lobby_code)
 
     def update_lobby_owner(self, lobby_code: str, new_owner_id: str):
         """Update lobby owner in DB"""
-        cur = self._db_conn.cursor()
-        cur.execute('UPDATE lobbies SET owner_id = ? WHERE lobby_code = ?', (new_owner_id, lobby_code))
-        self._db_conn.commit()
+        with self.transaction() as conn:
+            conn.execute(SQL_UPDATE_OWNER, (new_owner_id, lobby_code))
+        # Write through: the owner is a plain field, nothing else about the lobby changes
+        self._lobby_generation += 1
+        lobby = self._lobby_cache.get(lobby_code)
+        if lobby is not None:
+            lobby.owner_id = new_owner_id
     
     def update_player_color(self, client_id: str, new_color: str):
         """Update a player's color in the database"""
-        cur = self._db_conn.cursor()
-        cur.execute('UPDATE client_lobby_map SET player_color = ? WHERE client_id = ?', (new_color, client_id))
-        self._db_conn.commit()
+        with self.transaction() as conn:
+            conn.execute(SQL_UPDATE_PLAYER_COLOR, (new_color, client_id))
+        self._invalidate_client_lobby(client_id)
     
     def update_lobby_player_colors(self, lobby_code: str, player_color_mapping: dict):
         """Update multiple player colors for a lobby"""
-        cur = self._db_conn.cursor()
-        for client_id, color in player_color_mapping.items():
-            cur.execute('UPDATE client_lobby_map SET player_color = ? WHERE client_id = ? AND lobby_code = ?', 
-                       (color, client_id, lobby_code))
-        self._db_conn.commit()
\ No newline at end of file
+        with self.transaction() as conn:
+            conn.executemany(SQL_UPDATE_LOBBY_PLAYER_COLOR,
+                             [(color, client_id, lobby_code) for client_id, color in player_color_mapping.items()])
+        self._invalidate_lobby(lobby_code)
\ No newline at end of file
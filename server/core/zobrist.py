@@ -0,0 +1,25 @@
+"""SplitMix64 random stream for zobrist keys.
+
+ChessGame's position hash and the engine's search keys both draw from it,
+so there is one key generator in the server.
+"""
+from typing import Iterator, Tuple
+
+MASK64 = (1 << 64) - 1
+
+
+def splitmix64(state: int) -> Tuple[int, int]:
+    """One SplitMix64 step: returns (next_state, 64-bit output)"""
+    state = (state + 0x9E3779B97F4A7C15) & MASK64
+    z = state
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & MASK64
+    return state, z ^ (z >> 31)
+
+
+def splitmix64_stream(seed: int) -> Iterator[int]:
+    """Endless 64-bit outputs of the SplitMix64 sequence starting at seed"""
+    state = seed
+    while True:
+        state, value = splitmix64(state)
+        yield value
@@ -12,9 +12,10 @@ import math
 import copy
 from server.core.game import ChessGame
 from server.core.enums import PieceType, Color
-from server.core.piece import Piece
+from server.core.piece import Piece, PIECE_TYPE_INDEX as _PT_IDX
+from server.core.zobrist import splitmix64
 import time
-import random
+from array import array
 
 # Centipawn piece base values (Stockfish-like)
 # Centipawn piece base values (Stockfish-like)
@@ -27,11 +28,69 @@ PIECE_VALUES = {
     PieceType.KING: 20000,
 }
 INF = 1000000
+POS_INF = math.inf
+NEG_INF = -math.inf
+NULL_MOVE_R = 2  # depth reduction for the null-move search
+
+# Capture ordering score: MVV_LVA[victim_pt_idx][attacker_pt_idx] (most valuable victim, least valuable attacker)
+_PT_BY_IDX = {idx: pt for pt, idx in _PT_IDX.items()}
+MVV_LVA = [[100000 + PIECE_VALUES[_PT_BY_IDX[v]] * 100 - PIECE_VALUES[_PT_BY_IDX[a]] if v and a else 0
+            for a in range(7)] for v in range(7)]
+
+# One bit per ability, so a piece's ability set fits in a 6-bit mask
+ABILITY_BIT = {pt: 1 << i for i, pt in enumerate(
+    (PieceType.PAWN, PieceType.ROOK, PieceType.KNIGHT, PieceType.BISHOP, PieceType.QUEEN, PieceType.KING))}
+
+# Attack geometry for is_in_check, paired with the ability bits that attack along it
+_ORTHOGONAL_DIRS = ((-1,0),(1,0),(0,-1),(0,1))
+_DIAGONAL_DIRS = ((-1,-1),(-1,1),(1,-1),(1,1))
+_KNIGHT_OFFSETS = ((-2,-1),(-2,1),(-1,-2),(-1,2),(1,-2),(1,2),(2,-1),(2,1))
+_KING_OFFSETS = _ORTHOGONAL_DIRS + _DIAGONAL_DIRS
+_ORTHOGONAL_BITS = ABILITY_BIT[PieceType.ROOK] | ABILITY_BIT[PieceType.QUEEN]
+_DIAGONAL_BITS = ABILITY_BIT[PieceType.BISHOP] | ABILITY_BIT[PieceType.QUEEN]
+
+def ability_mask(abilities) -> int:
+    mask = 0
+    for ab in abilities:
+        mask |= ABILITY_BIT[ab]
+    return mask
+
+def _material_value(piece_type: PieceType, mask: int) -> int:
+    uniq = {ab for ab, bit in ABILITY_BIT.items() if mask & bit}
+    val = 0
+    for ab in uniq:
+        if (ab == PieceType.BISHOP or ab == PieceType.ROOK) and PieceType.QUEEN in uniq:
+            continue  # avoid double counting major pieces
+        if (ab == PieceType.PAWN and (PieceType.BISHOP in uniq  or PieceType.QUEEN in uniq)):
+            continue  # avoid double counting minor pieces if major present
+        val += PIECE_VALUES.get(ab, 0)
+    if piece_type not in uniq:
+        val += PIECE_VALUES[piece_type]
+    ability_count = mask.bit_count()
+    if ability_count >= 2:
+        val += int(120 * (ability_count - 1))  # slightly higher synergy
+    return val
+
+# Material + synergy for every (piece type, ability mask) pair, so evaluation is a table lookup
+MATERIAL_TABLE = {pt: [_material_value(pt, mask) for mask in range(64)] for pt in ABILITY_BIT}
 
 
 
 # 只顯示整個 Engine 類（可整段替換原本 Engine 類）
 
+# Moves are packed ints: from_sq << 6 | to_sq (sq = row * 8 + col); fits in 12 bits
+Move = int
+NO_MOVE = 0xFFFF  # packed best_move placeholder for "none"
+
+def pack_move(mv: Tuple[Tuple[int,int],Tuple[int,int]]) -> Move:
+    """Pack a ((from_row, from_col), (to_row, to_col)) move"""
+    (r1, c1), (r2, c2) = mv
+    return (r1 * 8 + c1) << 6 | (r2 * 8 + c2)
+
+def unpack_move(packed: Move) -> Tuple[Tuple[int,int],Tuple[int,int]]:
+    from_sq, to_sq = packed >> 6, packed & 63
+    return (from_sq >> 3, from_sq & 7), (to_sq >> 3, to_sq & 7)
+
 # TT flags
 EXACT = 0
 LOWERBOUND = 1
@@ -41,7 +100,8 @@ class TTEntry(NamedTuple):
     depth: int
     flag: int
     value: int
-    best_move: Optional[Tuple[Tuple[int,int],Tuple[int,int]]]
+    best_move: Optional[Move]
+    key: int = 0  # full zobrist key, to tell apart positions sharing a slot
 
 class MoveState:
     def __init__(self, move,
@@ -50,27 +110,68 @@ class MoveState:
                  captured_piece_ref,
                  captured_prev_position,
                  captured_prev_has_moved,
-                 captured_prev_abilities):
+                 captured_prev_abilities,
+                 moved_piece_prev_mask=0,
+                 captured_prev_mask=0):
         self.move = move
         self.moved_piece_prev_has_moved = moved_piece_prev_has_moved
-        # shallow copy of abilities list (list of primitives/strings)
-        self.moved_piece_prev_abilities = list(moved_piece_prev_abilities)
+        # abilities list as it was before an absorbing capture, None if the move left it untouched
+        # (apply_move hands over its own copy)
+        self.moved_piece_prev_abilities = moved_piece_prev_abilities
         # if captured_piece_ref is None, it's a quiet move
         self.captured_piece_ref = captured_piece_ref
         self.captured_prev_position = captured_prev_position
         self.captured_prev_has_moved = captured_prev_has_moved
-        self.captured_prev_abilities = list(captured_prev_abilities) if captured_prev_abilities is not None else None
+        self.captured_prev_abilities = captured_prev_abilities
+        self.moved_piece_prev_mask = moved_piece_prev_mask
+        self.captured_prev_mask = captured_prev_mask
 
 
 class TranspositionTable:
-    def __init__(self):
-        self.table = {}
-
-    def lookup(self, key: int):
-        return self.table.get(key)
+    """
+    Fixed-size table kept in flat typed arrays (no per-entry objects, memory bounded up front).
+    Two entries per bucket indexed by the low bits of the zobrist key:
+    the first keeps the deepest result (depth-preferred), the second is always replaced.
+    Default size: 2 * 2**19 entries of 16 bytes, 16 MiB.
+    """
+    def __init__(self, size_bits: int = 19):
+        self.mask = (1 << size_bits) - 1
+        self.size = 2 << size_bits
+        self.clear()
+
+    def clear(self):
+        n = self.size
+        self.keys = array('Q', bytes(8 * n))
+        self.depths = array('b', [-1]) * n  # -1 marks an empty entry
+        self.flags = array('b', bytes(n))
+        self.values = array('i', bytes(4 * n))  # scores stay within +-INF
+        self.moves = array('H', [NO_MOVE]) * n
+        self.filled = 0
+
+    def lookup(self, key: int) -> Optional[TTEntry]:
+        i = (key & self.mask) << 1
+        keys, depths = self.keys, self.depths
+        for j in (i, i + 1):
+            if keys[j] == key and depths[j] >= 0:
+                move = self.moves[j]
+                return TTEntry(depths[j], self.flags[j], self.values[j],
+                               None if move == NO_MOVE else move, key)
+        return None
 
-    def store(self, key: int, value: int, depth: int, flag: str, best_move=None):
-        self.table[key] = TTEntry(value, depth, flag, best_move)
+    def store(self, key: int, value: int, depth: int, flag: int, best_move=None):
+        i = (key & self.mask) << 1
+        if self.keys[i] != key and depth < self.depths[i]:
+            i += 1
+        # Track occupancy as entries fill (an entry counts while its depth is >= 0)
+        self.filled += (depth >= 0) - (self.depths[i] >= 0)
+        self.keys[i] = key
+        self.depths[i] = depth
+        self.flags[i] = flag
+        self.values[i] = value
+        self.moves[i] = NO_MOVE if best_move is None else best_move
+
+    def __len__(self):
+        return self.filled
 
 class Engine():
     def __init__(self, game: ChessGame):
@@ -78,118 +179,159 @@ class Engine():
         self.transposition_table = TranspositionTable()
         self.root_depth = 0
         self.node_count = 0
-        # Transposition table
-        self.tt: Dict[int, TTEntry] = {}
         #self.best_move : Optional[Tuple[Tuple[int,int],Tuple[int,int]]] = None
         # Zobrist initialization
-        random.seed(0xC0FFEE)  # 固定種子，方便除錯（可改為 None）
-        # zobrist_piece[sq_index][piece_type_value][color_value] -> 64bit
-        self.zobrist_piece = {}
+        # SplitMix64 stream with a fixed seed: deterministic keys, and the global random module is left alone
+        self.zobrist_seed = 0xC0FFEE  # 固定種子，方便除錯
+        # zobrist_piece[(sq_index * 7 + piece_type_index) * 2 + color_index] -> 64bit
+        # (flat list, one index instead of three nested dict lookups; slots for type 0 stay unused)
+        self.zobrist_piece: List[int] = [0] * (64 * 7 * 2)
         for sq in range(64):
-            self.zobrist_piece[sq] = {}
-            for pt in range(1, 7):  # assume PieceType enum values 1..6
-                self.zobrist_piece[sq][pt] = {}
-                self.zobrist_piece[sq][pt][0] = random.getrandbits(64)
-                self.zobrist_piece[sq][pt][1] = random.getrandbits(64)
-        # ability random map (dynamic)
-        self.zobrist_ability: Dict[str, int] = {}
+            for pt in range(1, 7):  # piece_type_index values 1..6
+                base = (sq * 7 + pt) * 2
+                self.zobrist_piece[base] = self.next_zobrist_rand()
+                self.zobrist_piece[base + 1] = self.next_zobrist_rand()
         # side to move random
-        self.zobrist_side = random.getrandbits(64)
+        self.zobrist_side = self.next_zobrist_rand()
+        # ability randoms, pre-rolled for every PieceType
+        self.zobrist_ability: Dict[PieceType, int] = {pt: self.next_zobrist_rand() for pt in PieceType}
+        # xor of the ability randoms for every ability mask, so a set of abilities is one lookup
+        self.zobrist_ability_mask: List[int] = [0] * 64
+        for mask in range(64):
+            for pt, bit in ABILITY_BIT.items():
+                if mask & bit:
+                    self.zobrist_ability_mask[mask] ^= self.zobrist_ability[pt]
+
+        # live pieces: (r, c) -> Piece, kept in sync by apply_move/undo_move
+        self.piece_list: Dict[Tuple[int,int], Piece] = self.build_piece_list()
+        # ability bitmask per occupied square, moved along with piece_list
+        self.piece_masks: Dict[Tuple[int,int], int] = self.build_piece_masks()
+        # king square per colour (None once captured), kept in sync by apply_move/undo_move
+        self.king_sq: Dict[Color, Optional[Tuple[int,int]]] = self.build_king_squares()
 
         # current zobrist key (init from board)
         self.zobrist_key = self.compute_full_zobrist()
 
-        # killer moves: killer[depth] -> list of up to 2 killer moves
-        self.killer: Dict[int, List[Tuple[Tuple[int,int],Tuple[int,int]]]] = {}
-        # history heuristic: history[(from_sq,to_sq)] -> score
-        self.history: Dict[Tuple[int,int], int] = {}
+        # killer moves: killer[depth] -> list of up to 2 killer moves (newest first),
+        # mirrored in killer_set[depth] for O(1) membership tests
+        self.killer: Dict[int, List[Move]] = {}
+        self.killer_set: Dict[int, set] = {}
+        # history heuristic: history[move] -> score (dense, indexed by the packed move)
+        self.history: List[int] = [0] * 4096
+        # mobility counts per position: zobrist_key -> (white_moves, black_moves)
+        self.mobility_cache: Dict[int, Tuple[int,int]] = {}
+        self.mobility_cache_limit = 200000
+
+    def set_game(self, game: ChessGame):
+        """Point the engine at a new position, keeping TT/killer/history tables from earlier searches"""
+        self.game = game
+        self.node_count = 0
+        self.piece_list = self.build_piece_list()
+        self.piece_masks = self.build_piece_masks()
+        self.king_sq = self.build_king_squares()
+        self.zobrist_key = self.compute_full_zobrist()
+
+    def reset_search_tables(self):
+        """Forget everything learned from earlier searches (call when a new game starts)"""
+        self.transposition_table.clear()
+        self.killer.clear()
+        self.killer_set.clear()
+        self.history = [0] * 4096
+        self.mobility_cache.clear()
+
+    def build_piece_list(self) -> Dict[Tuple[int,int], Piece]:
+        """Scan the board once for the occupied squares (and stamp each piece's table indices)"""
+        board = self.game.board
+        occupancy = self.game.occupancy
+        occupied = occupancy[Color.WHITE] | occupancy[Color.BLACK]
+        pieces = {}
+        while occupied:
+            sq = (occupied & -occupied).bit_length() - 1
+            pieces[(sq >> 3, sq & 7)] = board[sq >> 3][sq & 7]
+            occupied &= occupied - 1
+        return pieces
+
+    def build_piece_masks(self) -> Dict[Tuple[int,int], int]:
+        return {sq: ability_mask(p.abilities) for sq, p in self.piece_list.items()}
+
+    def build_king_squares(self) -> Dict[Color, Optional[Tuple[int,int]]]:
+        king_sq = {Color.WHITE: None, Color.BLACK: None}
+        for sq, p in self.piece_list.items():
+            if p.type == PieceType.KING:
+                king_sq[p.color] = sq
+        return king_sq
 
     # ---------- Zobrist helpers ----------
-    def ability_rand(self, ability: str) -> int:
+    def next_zobrist_rand(self) -> int:
+        self.zobrist_seed, value = splitmix64(self.zobrist_seed)
+        return value
+
+    def ability_rand(self, ability: PieceType) -> int:
         if ability not in self.zobrist_ability:
-            self.zobrist_ability[ability] = random.getrandbits(64)
+            self.zobrist_ability[ability] = self.next_zobrist_rand()
         return self.zobrist_ability[ability]
 
     def sq_index(self, r: int, c: int) -> int:
         return r * 8 + c
 
     def piece_type_index(self, p: Piece) -> int:
-        # Map PieceType enum to integer 1..6
-        piece_type_map = {
-            PieceType.PAWN: 1,
-            PieceType.ROOK: 2,
-            PieceType.KNIGHT: 3,
-            PieceType.BISHOP: 4,
-            PieceType.QUEEN: 5,
-            PieceType.KING: 6
-        }
-        return piece_type_map.get(p.type, 1)  # Default to 1 if not found
+        # PieceType as integer 1..6, cached on the piece
+        return p._pt_idx
 
     def color_index(self, p: Piece) -> int:
-        return 0 if p.color == Color.WHITE else 1
+        return p._col_idx
 
     def compute_full_zobrist(self) -> int:
         key = 0
-        for r in range(8):
-            for c in range(8):
-                p = self.game.board[r][c]
-                if not p:
-                    continue
-                sq = self.sq_index(r, c)
-                pt_idx = self.piece_type_index(p)
-                col_idx = self.color_index(p)
-                key ^= self.zobrist_piece[sq][pt_idx][col_idx]
-                # abilities
-                for ab in set(p.abilities):
-                    key ^= self.ability_rand(str(ab))
+        for (r, c), p in self.piece_list.items():
+            key = self.xor_piece_at(key, r, c, p)
         # side to move
         if self.game.current_turn == Color.BLACK:
             key ^= self.zobrist_side
         return key
 
-    # incremental updates inside apply_move/undo_move: use xor to remove/add
+    # xor a whole piece (type/colour on its square plus its ability set) in or out of key;
+    # apply_move/undo_move do the same incrementally inline
     def xor_piece_at(self, key: int, r: int, c: int, p: Optional[Piece]) -> int:
         if p is None:
             return key
-        sq = self.sq_index(r, c)
-        pt_idx = self.piece_type_index(p)
-        col_idx = self.color_index(p)
-        key ^= self.zobrist_piece[sq][pt_idx][col_idx]
-        for ab in set(p.abilities):
-            key ^= self.ability_rand(str(ab))
-        return key
+        key ^= self.zobrist_piece[((r * 8 + c) * 7 + p._pt_idx) * 2 + p._col_idx]
+        return key ^ self.zobrist_ability_mask[ability_mask(p.abilities)]
 
     # ------------------------------
     # Apply and undo moves (record minimal state to restore)  -- modified to update zobrist
     # ------------------------------
     
     # apply_move: 不做 deepcopy，只記錄被吃掉物件的必要欄位來還原
-    def apply_move(self, move: Tuple[Tuple[int,int], Tuple[int,int]]) -> MoveState:
-        (r1,c1),(r2,c2) = move
+    def apply_move(self, move: Move) -> MoveState:
+        from_sq, to_sq = move >> 6, move & 63
+        r1, c1, r2, c2 = from_sq >> 3, from_sq & 7, to_sq >> 3, to_sq & 7
         mover: Piece = self.game.board[r1][c1]
         captured: Optional[Piece] = self.game.board[r2][c2]
 
         # Save previous state for mover
         prev_has_moved = mover.has_moved
-        prev_abilities = mover.abilities.copy()  # shallow copy of abilities list
+        prev_abilities = None  # only snapshotted when a capture actually adds abilities
 
-        # Zobrist: xor out mover from source square
-        self.zobrist_key = self.xor_piece_at(self.zobrist_key, r1, c1, mover)
+        masks = self.piece_masks
+        prev_mask = masks.pop((r1, c1))
+        captured_prev_mask = masks[(r2, c2)] if captured else 0
+        masks[(r2, c2)] = prev_mask | captured_prev_mask
 
         if captured:
             # Save captured minimal state (no deepcopy)
             captured_ref = captured
             captured_prev_pos = captured.position
             captured_prev_has_moved = captured.has_moved
-            captured_prev_abilities = captured.abilities.copy()
-
-            # xor out captured from destination square
-            self.zobrist_key = self.xor_piece_at(self.zobrist_key, r2, c2, captured_ref)
-
-            # Absorb abilities (append only new ones)
-            for ab in captured_ref.abilities:
-                if ab not in mover.abilities:
-                    mover.abilities.append(ab)
+            captured_prev_abilities = None  # the captured piece's abilities are never mutated
+
+            # Absorb abilities (append only new ones; the masks tell us if there are any)
+            new_bits = captured_prev_mask & ~prev_mask
+            if new_bits:
+                prev_abilities = mover.abilities.copy()
+                for ab in captured_ref.abilities:
+                    if ABILITY_BIT[ab] & new_bits:
+                        mover.abilities.append(ab)
         else:
             captured_ref = None
             captured_prev_pos = None
@@ -201,54 +343,89 @@ class Engine():
         mover.has_moved = True
         self.game.board[r2][c2] = mover
         self.game.board[r1][c1] = None
-
-        # Zobrist: xor in mover at destination (with possibly new abilities)
-        self.zobrist_key = self.xor_piece_at(self.zobrist_key, r2, c2, mover)
-
-        # flip side in zobrist and game
-        self.zobrist_key ^= self.zobrist_side
+        occupancy = self.game.occupancy
+        occupancy[mover.color] ^= (1 << from_sq) | (1 << to_sq)
+        if captured_ref:
+            occupancy[captured_ref.color] ^= 1 << to_sq
+        # captured entry (if any) is overwritten by the mover
+        del self.piece_list[(r1, c1)]
+        self.piece_list[(r2, c2)] = mover
+        if mover.type == PieceType.KING:
+            self.king_sq[mover.color] = (r2, c2)
+        if captured_ref and captured_ref.type == PieceType.KING:
+            self.king_sq[captured_ref.color] = None
+
+        # Zobrist: move the mover's type/colour from source to destination (its old abilities
+        # would be xored out and back in, so they cancel), xor out the captured piece entirely,
+        # xor in only the abilities the mover gained, and flip the side to move
+        zp = self.zobrist_piece
+        pc = mover._pt_idx * 2 + mover._col_idx
+        key = self.zobrist_key ^ zp[from_sq * 14 + pc] ^ zp[to_sq * 14 + pc] ^ self.zobrist_side
+        if captured_ref:
+            key ^= (zp[to_sq * 14 + captured_ref._pt_idx * 2 + captured_ref._col_idx]
+                    ^ self.zobrist_ability_mask[captured_prev_mask]
+                    ^ self.zobrist_ability_mask[captured_prev_mask & ~prev_mask])
+        self.zobrist_key = key
+
+        # flip side in game
         self.game.current_turn = Color.WHITE if self.game.current_turn == Color.BLACK else Color.BLACK
 
         return MoveState(move, prev_has_moved, prev_abilities,
-                        captured_ref, captured_prev_pos, captured_prev_has_moved, captured_prev_abilities)
+                        captured_ref, captured_prev_pos, captured_prev_has_moved, captured_prev_abilities,
+                        prev_mask, captured_prev_mask)
 
     # undo_move: 用保存的最小欄位回復狀態
     def undo_move(self, state: MoveState):
-        (r1,c1),(r2,c2) = state.move
+        from_sq, to_sq = state.move >> 6, state.move & 63
+        r1, c1, r2, c2 = from_sq >> 3, from_sq & 7, to_sq >> 3, to_sq & 7
         mover: Piece = self.game.board[r2][c2]
 
-        # xor out mover at dest (current state)
-        self.zobrist_key = self.xor_piece_at(self.zobrist_key, r2, c2, mover)
+        # Zobrist: exact inverse of the xors in apply_move
+        zp = self.zobrist_piece
+        pc = mover._pt_idx * 2 + mover._col_idx
+        key = self.zobrist_key ^ zp[from_sq * 14 + pc] ^ zp[to_sq * 14 + pc] ^ self.zobrist_side
+        cap = state.captured_piece_ref
+        if cap:
+            key ^= (zp[to_sq * 14 + cap._pt_idx * 2 + cap._col_idx]
+                    ^ self.zobrist_ability_mask[state.captured_prev_mask]
+                    ^ self.zobrist_ability_mask[state.captured_prev_mask & ~state.moved_piece_prev_mask])
+        self.zobrist_key = key
 
         # restore mover fields
         mover.position = (r1, c1)
         mover.has_moved = state.moved_piece_prev_has_moved
-        mover.abilities = list(state.moved_piece_prev_abilities)
+        if state.moved_piece_prev_abilities is not None:
+            mover.abilities = state.moved_piece_prev_abilities
 
         # put mover back to source square
         self.game.board[r1][c1] = mover
+        occupancy = self.game.occupancy
+        occupancy[mover.color] ^= (1 << from_sq) | (1 << to_sq)
+        if cap:
+            occupancy[cap.color] ^= 1 << to_sq
+        self.piece_list[(r1, c1)] = mover
+        self.piece_masks[(r1, c1)] = state.moved_piece_prev_mask
+        if mover.type == PieceType.KING:
+            self.king_sq[mover.color] = (r1, c1)
 
         # restore captured (if any)
-        if state.captured_piece_ref:
-            cap = state.captured_piece_ref
+        if cap:
             # restore captured attributes
             cap.position = state.captured_prev_position
             cap.has_moved = state.captured_prev_has_moved
-            cap.abilities = list(state.captured_prev_abilities)
             # place captured back to destination square
             self.game.board[r2][c2] = cap
-
-            # xor in the captured at dest
-            self.zobrist_key = self.xor_piece_at(self.zobrist_key, r2, c2, cap)
+            self.piece_list[(r2, c2)] = cap
+            self.piece_masks[(r2, c2)] = state.captured_prev_mask
+            if cap.type == PieceType.KING:
+                self.king_sq[cap.color] = (r2, c2)
         else:
             # destination is empty now
             self.game.board[r2][c2] = None
-
-        # xor in mover at source square
-        self.zobrist_key = self.xor_piece_at(self.zobrist_key, r1, c1, mover)
+            del self.piece_list[(r2, c2)]
+            del self.piece_masks[(r2, c2)]
 
         # flip side back
-        self.zobrist_key ^= self.zobrist_side
         self.game.current_turn = Color.WHITE if self.game.current_turn == Color.BLACK else Color.BLACK
 
     
@@ -259,95 +436,113 @@ class Engine():
         """Return TTEntry or None. Default key = current zobrist."""
         if key is None:
             key = self.zobrist_key
-        return self.tt.get(key)
+        return self.transposition_table.lookup(key)
 
     def tt_store(self, depth: int, flag: int, value: int,
-                best_move: Optional[Tuple[Tuple[int,int],Tuple[int,int]]],
+                best_move: Optional[Move],
                 key: Optional[int] = None) -> None:
         """Store a TTEntry under key (default = current zobrist)."""
         if key is None:
             key = self.zobrist_key
-        # Simple replace policy: replace if deeper or not present.
-        existing = self.tt.get(key)
-        if existing is None or depth >= existing.depth:
-            self.tt[key] = TTEntry(depth, flag, value, best_move)
+        self.transposition_table.store(key, value, depth, flag, best_move)
 
 
+    def add_killer(self, ply: int, mv: Move) -> None:
+        """Remember a cutoff move for this ply (keeps the 2 most recent)"""
+        km_set = self.killer_set.setdefault(ply, set())
+        if mv in km_set:
+            return
+        km = self.killer.setdefault(ply, [])
+        km.insert(0, mv)
+        km_set.add(mv)
+        if len(km) > 2:
+            km_set.discard(km.pop())
+
     # =========================
     # Centralized move ordering
     # =========================
-    def order_moves(self,
-                    moves: List[Tuple[Tuple[int,int], Tuple[int,int]]],
+    def score_moves(self,
+                    moves: List[Move],
                     ply: int,
-                    tt_move: Optional[Tuple[Tuple[int,int],Tuple[int,int]]] = None
-                ) -> List[Tuple[Tuple[int,int], Tuple[int,int]]]:
+                    tt_move: Optional[Move] = None
+                ) -> List[int]:
         """
-        Order moves using:
+        Score moves for ordering using:
         1) TT best move (if present)
         2) MVV-LVA for captures
         3) Killer moves for ply
         4) History heuristic
-        Returns a new list of moves ordered descending (best first).
+        Returns a list of scores parallel to moves (higher = try first).
         """
         board = self.game.board
         pv = tt_move
-        piece_vals = PIECE_VALUES
-        killer_list = self.killer.get(ply, [])
+        mvv_lva = MVV_LVA
+        killer_set = self.killer_set.get(ply, ())
         hist = self.history
 
-        scored: List[Tuple[int, Tuple[Tuple[int,int], Tuple[int,int]]]] = []
+        scores: List[int] = []
         # micro-optimizations: localize lookups
         for mv in moves:
-            (r1, c1), (r2, c2) = mv
             s = 0
             # TT best move gets very large boost
-            if pv is not None and mv == pv:
+            if mv == pv:
                 s += 1_000_000_000
 
-            tgt = board[r2][c2]
+            to_sq = mv & 63
+            tgt = board[to_sq >> 3][to_sq & 7]
             # MVV-LVA-ish: prefer captures of high-value victim and low-value attacker
             if tgt is not None:
-                victim_val = piece_vals.get(tgt.type, 0)
-                attacker = board[r1][c1]
-                attacker_val = piece_vals.get(attacker.type, 0) if attacker else 0
-                s += 100000 + (victim_val * 100) - attacker_val
+                from_sq = mv >> 6
+                s += mvv_lva[tgt._pt_idx][board[from_sq >> 3][from_sq & 7]._pt_idx]
 
             # killer heuristic
-            if mv in killer_list:
+            if mv in killer_set:
                 s += 5000
 
             # history heuristic (from_sq,to_sq)
-            key = (r1*8 + c1, r2*8 + c2)
-            s += hist.get(key, 0)
+            s += hist[mv]
+
+            scores.append(s)
 
-            scored.append((s, mv))
+        return scores
+
+    def pick_moves(self, moves: List[Move], scores: List[int]):
+        """
+        Yield moves best-first by partial selection sort (reorders both lists in place).
+        A cutoff usually comes within the first few moves, so the rest never get sorted.
+        """
+        n = len(moves)
+        for i in range(n):
+            tail = scores[i:]
+            j = i + tail.index(max(tail))
+            if j != i:
+                moves[i], moves[j] = moves[j], moves[i]
+                scores[i], scores[j] = scores[j], scores[i]
+            yield moves[i]
 
-        # sort descending by score (stable)
-        scored.sort(key=lambda x: x[0], reverse=True)
-        return [mv for (_, mv) in scored]
+    def order_moves(self,
+                    moves: List[Move],
+                    ply: int,
+                    tt_move: Optional[Move] = None
+                ) -> List[Move]:
+        """Return a new list of moves fully ordered best first (see score_moves)."""
+        moves = list(moves)
+        return list(self.pick_moves(moves, self.score_moves(moves, ply, tt_move)))
     
     
-    def generate_all_moves(self, color: Color) -> List[Tuple[Tuple[int,int], Tuple[int,int]]]:
+    def generate_all_moves(self, color: Color) -> List[Move]:
         """
         Generate all valid moves for the given color.
-        Returns list of moves in format [((from_row, from_col), (to_row, to_col)), ...]
+        Returns list of packed moves (see pack_move / unpack_move)
         """
         moves = []
-        
-        # Save the current turn
-        original_turn = self.game.current_turn
-        
-        # Temporarily switch to the desired color to get its moves
-        self.game.current_turn = color
-        valid_moves_dict = self.game.calculate_moves_fast()
-
-        # Restore the original turn
-        self.game.current_turn = original_turn
+        valid_moves_dict = self.game.calculate_moves_fast(color)
 
         # Convert the moves to our format
         for (from_row, from_col), move_list in valid_moves_dict.items():
+            from_bits = (from_row * 8 + from_col) << 6
             for (to_row, to_col) in move_list:
-                moves.append(((from_row, from_col), (to_row, to_col)))
+                moves.append(from_bits | (to_row * 8 + to_col))
         
         return moves
 
@@ -360,14 +555,12 @@ class Engine():
         """
         white_king = False
         black_king = False
-        for r in range(8):
-            for c in range(8):
-                p = self.game.board[r][c]
-                if p and p.type == PieceType.KING:
-                    if p.color == Color.WHITE:
-                        white_king = True
-                    else:
-                        black_king = True
+        for p in self.piece_list.values():
+            if p.type == PieceType.KING:
+                if p.color == Color.WHITE:
+                    white_king = True
+                else:
+                    black_king = True
         if not white_king:
             return -PIECE_VALUES[PieceType.KING]  # White lost
         if not black_king:
@@ -385,63 +578,58 @@ class Engine():
         """
         score = 0
 
-        # Material & synergy
-        for r in range(8):
-            for c in range(8):
-                p = self.game.board[r][c]
-                if not p:
-                    continue
-                uniq = set(p.abilities)
-                val = 0
-                for ab in uniq:
-                    if (ab == PieceType.BISHOP or ab == PieceType.ROOK) and PieceType.QUEEN in uniq:
-                        continue  # avoid double counting major pieces
-                    if (ab == PieceType.PAWN and (PieceType.BISHOP in uniq  or PieceType.QUEEN in uniq)):
-                        continue  # avoid double counting minor pieces if major present
-                    val += PIECE_VALUES.get(ab, 0)
-                if p.type not in uniq:
-                    val += PIECE_VALUES[p.type]
-                ability_count = len(uniq)
-                if ability_count >= 2:
-                    synergy = int(120 * (ability_count - 1))  # slightly higher synergy
-                    val += synergy
-                score += val if p.color == Color.WHITE else -val
+        # Material & synergy (precomputed per type/ability mask)
+        masks = self.piece_masks
+        material = MATERIAL_TABLE
+        for sq, p in self.piece_list.items():
+            val = material[p.type][masks[sq]]
+            score += -val if p._col_idx else val
 
         # Castling rights bonus (if not already castled)
-        def castling_bonus(color):
-            bonus = 0
-            if(self.game.king_castled[color]):
-                return 120
-            king_row = 7 if color == Color.WHITE else 0
-            king = self.game.get_piece_at(king_row, 4)
-            if not king or king.type != PieceType.KING:
-                return 0
-            # King and rook(s) have not moved
-            if not king.has_moved:
-                # Kingside
-                rook = self.game.get_piece_at(king_row, 7)
-                if rook and rook.type == PieceType.ROOK and not rook.has_moved and rook.color == color:
-                    bonus += 60
-                # Queenside
-                rook = self.game.get_piece_at(king_row, 0)
-                if rook and rook.type == PieceType.ROOK and not rook.has_moved and rook.color == color:
-                    bonus += 60
-            return bonus
-
-        score += castling_bonus(Color.WHITE)
-        score -= castling_bonus(Color.BLACK)
-
-        # Mobility - calculate legal move count for each color (always from White's perspective)
-        original_turn = self.game.current_turn
-        self.game.current_turn = Color.WHITE
-        white_moves = len(self.game.calculate_moves_fast())
-        self.game.current_turn = Color.BLACK
-        black_moves = len(self.game.calculate_moves_fast())
-        self.game.current_turn = original_turn
+        score += self.castling_bonus(Color.WHITE)
+        score -= self.castling_bonus(Color.BLACK)
+
+        # Mobility - calculate legal move count for each color (always from White's perspective).
+        # Two full move generations dominate the leaf cost, so reuse them for transposed/re-searched positions
+        key = self.zobrist_key
+        mobility_cache = self.mobility_cache
+        mobility = mobility_cache.get(key)
+        if mobility is None:
+            calculate_moves = self.game.calculate_moves_fast
+            white_moves = len(calculate_moves(Color.WHITE))
+            black_moves = len(calculate_moves(Color.BLACK))
+            if len(mobility_cache) >= self.mobility_cache_limit:
+                mobility_cache.clear()
+            mobility_cache[key] = (white_moves, black_moves)
+        else:
+            white_moves, black_moves = mobility
         mobility_weight = 6  # centipawns per legal move difference
         score += (white_moves - black_moves) * mobility_weight
         return int(score)
 
+    def castling_bonus(self, color: Color) -> int:
+        """Castling rights bonus for color (if already castled still give the bonus)"""
+        game = self.game
+        if game.king_castled[color]:
+            return 120
+        king_row = 7 if color == Color.WHITE else 0
+        row = game.board[king_row]
+        king = row[4]
+        if not king or king.type != PieceType.KING:
+            return 0
+        bonus = 0
+        # King and rook(s) have not moved
+        if not king.has_moved:
+            # Kingside
+            rook = row[7]
+            if rook and rook.type == PieceType.ROOK and not rook.has_moved and rook.color == color:
+                bonus += 60
+            # Queenside
+            rook = row[0]
+            if rook and rook.type == PieceType.ROOK and not rook.has_moved and rook.color == color:
+                bonus += 60
+        return bonus
+
     # -------------------------
     # Enhanced quiescence search
     # -------------------------
@@ -453,22 +641,29 @@ class Engine():
             alpha = stand_pat
 
         # Only consider captures that pass a cheap SEE heuristic or are promotions (if you have)
+        board = self.game.board
+        piece_vals = PIECE_VALUES
         moves = self.generate_all_moves(self.game.current_turn)
-        cap_moves = []
+        scored_caps = []
+        threshold = alpha - 10 - stand_pat
         for mv in moves:
-            (r1,c1),(r2,c2) = mv
-            if self.game.board[r2][c2]:  # capture
-                # cheap filter: only include captures with victim_value - attacker_value + stand_pat > alpha- margin
-                if self.see_capture((r1,c1),(r2,c2)) + stand_pat >= alpha - 10:
-                    cap_moves.append(mv)
+            to_sq = mv & 63
+            victim = board[to_sq >> 3][to_sq & 7]
+            if victim:  # capture
+                from_sq = mv >> 6
+                attacker = board[from_sq >> 3][from_sq & 7]
+                # cheap filter (see_capture): only include captures with victim_value - attacker_value + stand_pat > alpha- margin
+                if piece_vals.get(victim.type, 0) - piece_vals.get(attacker.type, 0) >= threshold:
+                    scored_caps.append((MVV_LVA[victim._pt_idx][attacker._pt_idx], mv))
 
         # order captures MVV-LVA (victim value high -> try first)
-        cap_moves.sort(key=lambda mv: PIECE_VALUES.get(self.game.board[mv[1][0]][mv[1][1]].type,0), reverse=True)
+        scored_caps.sort(key=lambda x: x[0], reverse=True)
 
-        for mv in cap_moves:
-            state = self.apply_move(mv)
-            score = -self.quiescence(-beta, -alpha)
-            self.undo_move(state)
+        apply_move, undo_move, quiescence = self.apply_move, self.undo_move, self.quiescence
+        for _, mv in scored_caps:
+            state = apply_move(mv)
+            score = -quiescence(-beta, -alpha)
+            undo_move(state)
             if score >= beta:
                 return beta
             if score > alpha:
@@ -477,9 +672,9 @@ class Engine():
     # ------------------------------
     # Minimax with alpha-beta, TT, move ordering, killer/history, quiescence
     # ------------------------------
-    def minimax(self, depth: int, alpha: int, beta: int, maximizing_player: bool, ply: int = 0) -> Tuple[int, Optional[Tuple[Tuple[int,int],Tuple[int,int]]]]:
+    def minimax(self, depth: int, alpha: int, beta: int, maximizing_player: bool, ply: int = 0) -> Tuple[int, Optional[Move]]:
         # TT lookup
-        tt_entry = self.tt.get(self.zobrist_key)
+        tt_entry = self.transposition_table.lookup(self.zobrist_key)
         if tt_entry and tt_entry.depth >= depth:
             if tt_entry.flag == EXACT:
                 return tt_entry.value, tt_entry.best_move
@@ -505,34 +700,19 @@ class Engine():
         if not moves:
             return self.evaluate_board(), None
 
-        # move ordering:
-        def score_move(mv):
-            (r1,c1),(r2,c2) = mv
-            tgt = self.game.board[r2][c2]
-            score = 0
-            # captures: MVV-LVA: victim_value * 1000 - attacker_value
-            if tgt:
-                score += 100000 + PIECE_VALUES.get(tgt.type, 0) * 100 - PIECE_VALUES.get(self.game.board[r1][c1].type, 0)
-            # killer moves
-            km_list = self.killer.get(ply, [])
-            if mv in km_list:
-                score += 5000
-            # history heuristic
-            key = (r1*8+c1, r2*8+c2)
-            score += self.history.get(key, 0)
-            return score
-
-        moves.sort(key=score_move, reverse=True)
+        # move ordering (moves are picked best-first lazily in the loops below)
+        scores = self.score_moves(moves, ply)
 
         best_move = None
         original_alpha = alpha
+        apply_move, undo_move, minimax = self.apply_move, self.undo_move, self.minimax
 
         if maximizing_player:
-            max_eval = -math.inf
-            for mv in moves:
-                state = self.apply_move(mv)
-                val, _ = self.minimax(depth - 1, alpha, beta, False, ply+1)
-                self.undo_move(state)
+            max_eval = NEG_INF
+            for mv in self.pick_moves(moves, scores):
+                state = apply_move(mv)
+                val, _ = minimax(depth - 1, alpha, beta, False, ply+1)
+                undo_move(state)
                 if val > max_eval:
                     max_eval = val
                     best_move = mv
@@ -541,37 +721,25 @@ class Engine():
                 # store history on cutoff
                 if alpha >= beta:
                     # killer heuristic: add move to killer for this ply
-                    km = self.killer.get(ply, [])
-                    if mv not in km:
-                        km.insert(0, mv)
-                        if len(km) > 2:
-                            km.pop()
-                        self.killer[ply] = km
+                    self.add_killer(ply, mv)
                     # history increase
-                    key = (mv[0][0]*8+mv[0][1], mv[1][0]*8+mv[1][1])
-                    self.history[key] = self.history.get(key, 0) + (1 << depth)
+                    self.history[mv] += 1 << depth
                     break
             value = int(max_eval)
         else:
-            min_eval = math.inf
-            for mv in moves:
-                state = self.apply_move(mv)
-                val, _ = self.minimax(depth - 1, alpha, beta, True, ply+1)
-                self.undo_move(state)
+            min_eval = POS_INF
+            for mv in self.pick_moves(moves, scores):
+                state = apply_move(mv)
+                val, _ = minimax(depth - 1, alpha, beta, True, ply+1)
+                undo_move(state)
                 if val < min_eval:
                     min_eval = val
                     best_move = mv
                 if val < beta:
                     beta = val
                 if alpha >= beta:
-                    km = self.killer.get(ply, [])
-                    if mv not in km:
-                        km.insert(0, mv)
-                        if len(km) > 2:
-                            km.pop()
-                        self.killer[ply] = km
-                    key = (mv[0][0]*8+mv[0][1], mv[1][0]*8+mv[1][1])
-                    self.history[key] = self.history.get(key, 0) + (1 << depth)
+                    self.add_killer(ply, mv)
+                    self.history[mv] += 1 << depth
                     break
             value = int(min_eval)
 
@@ -583,36 +751,63 @@ class Engine():
             flag = LOWERBOUND
         else:
             flag = EXACT
-        self.tt[self.zobrist_key] = TTEntry(depth, flag, value, best_move)
+        self.transposition_table.store(self.zobrist_key, value, depth, flag, best_move)
 
         return value, best_move
     
     def is_in_check(self, color: Color) -> bool:
-        """Return True if 'color' is in check. Uses generate moves of opponent and checks for capture of king."""
-        # find king square
-        kr = kc = None
-        for r in range(8):
-            for c in range(8):
-                p = self.game.board[r][c]
-                if p and p.type == PieceType.KING and p.color == color:
-                    kr, kc = r, c
-                    break
-            if kr is not None:
-                break
-        if kr is None:
+        """
+        Return True if 'color' is in check. Looks outward from the king square for an enemy piece
+        holding a matching ability (rays for rook/bishop/queen, then knight, pawn and king squares).
+        """
+        king = self.king_sq[color]
+        if king is None:
             return False
-        # Opponent moves - if any move targets king square => in check
-        orig_turn = self.game.current_turn
-        self.game.current_turn = Color.WHITE if color == Color.BLACK else Color.BLACK
-        opp_moves = self.game.calculate_moves_fast()
-        self.game.current_turn = orig_turn
-        # opp_moves is dict: keys (from_row,from_col) -> list of (to_row,to_col)
-        for _, mvlist in opp_moves.items():
-            for (tr, tc) in mvlist:
-                if tr == kr and tc == kc:
-                    return True
+        kr, kc = king
+        board = self.game.board
+        masks = self.piece_masks
+        # sliding attackers: the first piece on each ray decides
+        for dirs, bits in ((_ORTHOGONAL_DIRS, _ORTHOGONAL_BITS), (_DIAGONAL_DIRS, _DIAGONAL_BITS)):
+            for dr, dc in dirs:
+                r, c = kr + dr, kc + dc
+                while 0 <= r < 8 and 0 <= c < 8:
+                    p = board[r][c]
+                    if p is not None:
+                        if p.color != color and masks[(r, c)] & bits:
+                            return True
+                        break
+                    r += dr
+                    c += dc
+        for offsets, bit in ((_KNIGHT_OFFSETS, ABILITY_BIT[PieceType.KNIGHT]), (_KING_OFFSETS, ABILITY_BIT[PieceType.KING])):
+            for dr, dc in offsets:
+                r, c = kr + dr, kc + dc
+                if 0 <= r < 8 and 0 <= c < 8:
+                    p = board[r][c]
+                    if p is not None and p.color != color and masks[(r, c)] & bit:
+                        return True
+        # enemy pawns capture towards us: white pawns move up the board (row - 1), black down
+        pr = kr + 1 if color == Color.BLACK else kr - 1
+        pawn_bit = ABILITY_BIT[PieceType.PAWN]
+        if 0 <= pr < 8:
+            for c in (kc - 1, kc + 1):
+                if 0 <= c < 8:
+                    p = board[pr][c]
+                    if p is not None and p.color != color and masks[(pr, c)] & pawn_bit:
+                        return True
+        return False
+
+    def has_non_pawn_material(self, color: Color) -> bool:
+        """True if color has anything besides pawns and the king"""
+        for p in self.piece_list.values():
+            if p.color == color and p.type != PieceType.PAWN and p.type != PieceType.KING:
+                return True
         return False
 
+    def make_null_move(self):
+        """Pass the turn (its own inverse: call again to undo)"""
+        self.zobrist_key ^= self.zobrist_side
+        self.game.current_turn = Color.WHITE if self.game.current_turn == Color.BLACK else Color.BLACK
+
     def see_capture(self, from_sq: Tuple[int,int], to_sq: Tuple[int,int]) -> int:
         """
         Cheap SEE approximation (victim_value - attacker_value).
@@ -634,27 +829,43 @@ class Engine():
     # ---------------------------------------
     # Negamax with PVS, Null-move, LMR, TT
     # ---------------------------------------
-    def negamax(self, depth: int, alpha: int, beta: int, allow_null: bool = True) -> Tuple[Optional[Tuple[Tuple[int,int],Tuple[int,int]]], int]:
+    def negamax(self, depth: int, alpha: int, beta: int, allow_null: bool = True) -> Tuple[Optional[Move], int]:
         self.node_count += 1
         original_alpha = alpha
 
         # Transposition table probe
         entry = self.transposition_table.lookup(self.zobrist_key)
         if entry and entry.depth >= depth:
-            if entry.flag == "EXACT":
+            if entry.flag == EXACT:
                 return entry.best_move, entry.value
-            elif entry.flag == "LOWERBOUND":
+            elif entry.flag == LOWERBOUND:
                 alpha = max(alpha, entry.value)
-            elif entry.flag == "UPPERBOUND":
+            elif entry.flag == UPPERBOUND:
                 beta = min(beta, entry.value)
             if alpha >= beta:
                 return entry.best_move, entry.value
 
+        game = self.game
         # Terminal / quiescence
-        if depth == 0 or self.game.game_over:
+        if depth == 0 or game.game_over:
             return None, self.quiescence(alpha, beta)
 
-        color = 1 if self.game.current_turn == Color.WHITE else -1
+        turn = game.current_turn
+        color = 1 if turn == Color.WHITE else -1
+
+        # Null-move pruning: if passing still fails high, a real move will too.
+        # Skipped at PV nodes, in check, and without non-pawn material (zugzwang risk)
+        pv_node = beta - alpha > 1
+        in_check = depth >= 3 and self.is_in_check(turn)
+        if (allow_null and depth >= 3 and not pv_node and not in_check
+                and self.has_non_pawn_material(turn)):
+            self.make_null_move()
+            try:
+                _, val = self.negamax(depth - 1 - NULL_MOVE_R, -beta, -beta + 1, allow_null=False)
+            finally:
+                self.make_null_move()
+            if -val >= beta:
+                return None, beta
 
         # Futility pruning
         if depth == 1:
@@ -664,23 +875,44 @@ class Engine():
                 return None, static_eval
 
         # Move generation
-        moves = self.generate_all_moves(self.game.current_turn)
-        # print(f"[ENGINE DEBUG] Generated {len(moves)} moves for {self.game.current_turn}")
+        moves = self.generate_all_moves(turn)
+        # print(f"[ENGINE DEBUG] Generated {len(moves)} moves for {turn}")
         if not moves:
-            print(f"[ENGINE DEBUG] No moves available for {self.game.current_turn}")
+            print(f"[ENGINE DEBUG] No moves available for {turn}")
             return None, self.evaluate_board() * color
 
-        ordered_moves = self.order_moves(moves, depth, entry.best_move if entry else None)
+        scores = self.score_moves(moves, depth, entry.best_move if entry else None)
 
         best_value = -INF
         best_move = None
 
-        for move in ordered_moves:
-            state = self.apply_move(move)
+        board = game.board
+        apply_move, undo_move, negamax = self.apply_move, self.undo_move, self.negamax
+        for move_no, move in enumerate(self.pick_moves(moves, scores)):
+            # LMR: late quiet moves are searched shallower first
+            reduction = 0
+            if move_no >= 3 and depth >= 3 and not in_check and board[(move & 63) >> 3][move & 7] is None:
+                reduction = min(depth - 1, 1 + int(math.log(depth) * math.log(move_no) / 2))
+            state = apply_move(move)
             try:
-                _, val = self.negamax(depth - 1, -beta, -alpha, allow_null)
-                val = -val  # Negate for negamax
-                self.undo_move(state)
+                if move_no == 0:
+                    # PVS: the first (best-ordered) move gets the full window
+                    _, val = negamax(depth - 1, -beta, -alpha, True)
+                    val = -val  # Negate for negamax
+                else:
+                    val = None
+                    if reduction:
+                        _, val = negamax(depth - 1 - reduction, -alpha - 1, -alpha, True)
+                        val = -val
+                    if val is None or val > alpha:
+                        # the rest only have to prove they are no better than alpha at full depth...
+                        _, val = negamax(depth - 1, -alpha - 1, -alpha, True)
+                        val = -val
+                    if alpha < val < beta:
+                        # ...and are re-searched with the full window when they are
+                        _, val = negamax(depth - 1, -beta, -alpha, True)
+                        val = -val
+                undo_move(state)
 
                 if val > best_value:
                     best_value = val
@@ -691,15 +923,15 @@ class Engine():
                     break
             except Exception as e:
                 # print(f"[ENGINE DEBUG] Error in recursive negamax call: {e}")
-                self.undo_move(state)
+                undo_move(state)
                 raise
 
         # Store in TT
-        flag = "EXACT"
+        flag = EXACT
         if best_value <= original_alpha:
-            flag = "UPPERBOUND"
+            flag = UPPERBOUND
         elif best_value >= beta:
-            flag = "LOWERBOUND"
+            flag = LOWERBOUND
 
         self.transposition_table.store(self.zobrist_key, best_value, depth, flag, best_move)
 
@@ -737,9 +969,10 @@ class Engine():
                     best_move = current_move
                     break
 
-            print(f"[ENGINE] Depth {d} completed. Best move: {best_move}, Eval: {best_eval}")
+            print(f"[ENGINE] Depth {d} completed. Best move: {unpack_move(best_move) if best_move is not None else None}, Eval: {best_eval}")
 
-        return best_move, best_eval
+        # callers get the ((from_row, from_col), (to_row, to_col)) form
+        return (unpack_move(best_move) if best_move is not None else None), best_eval
 
     def find_best_move_with_time_limit(self, max_depth: int = 4, max_time: float = 5.0) -> Tuple[Optional[Tuple[Tuple[int,int],Tuple[int,int]]], int, int]:
         """
@@ -760,6 +993,7 @@ class Engine():
         
         # Clear search tables for fresh start
         self.killer.clear()
+        self.killer_set.clear()
         
         # Iterative deepening with negamax
         for depth in range(1, max_depth + 1):
@@ -774,17 +1008,17 @@ class Engine():
                 if self.game.current_turn == Color.BLACK:
                     current_eval = -current_eval
                 
-                if current_move:
-                    best_move = current_move
+                if current_move is not None:
+                    best_move = unpack_move(current_move)
                     best_eval = current_eval
                     depth_reached = depth
                     elapsed = time.time() - start_time
-                    print(f"[ENGINE] Depth {depth}: {current_move} (eval: {current_eval}, time: {elapsed:.2f}s)")
+                    print(f"[ENGINE] Depth {depth}: {best_move} (eval: {current_eval}, time: {elapsed:.2f}s)")
             except KeyboardInterrupt:
                 print(f"[ENGINE] Search interrupted at depth {depth}")
                 break
                 
         total_time = time.time() - start_time
         print(f"[ENGINE] Advanced search completed: depth {depth_reached}, time {total_time:.2f}s")
-        print(f"[ENGINE] Transposition table entries: {len(self.tt)}")
+        print(f"[ENGINE] Transposition table entries: {len(self.transposition_table)}")
         return best_move, best_eval, depth_reached
@@ -1,6 +1,9 @@
 import asyncio
+import logging
+from collections import OrderedDict, defaultdict, deque
 from calendar import c
-import datetime
+import time
+from typing import Dict
 from dataclasses import asdict
 from turtle import color
 from server.core.game import ChessGame
@@ -11,27 +14,132 @@ from server.engine.oldengine.engine import Engine
 # Removed: from server.engine.bot_engine import get_bot_engine_manager  # Now using frontend bot
 #from server.networking.connection import ConnectionManager
 
+logger = logging.getLogger(__name__)
+
+# Draw offers allowed per player within the sliding window
+DRAW_OFFER_LIMIT = 3
+DRAW_OFFER_WINDOW_NS = 60 * 1_000_000_000
+
+# invalid_move codes, so clients can tell rejections apart without parsing details
+E_GAME_OVER = 1
+E_NO_PIECE = 2
+E_WRONG_TURN = 3
+E_ILLEGAL_MOVE = 4
+E_PROMOTION_PENDING = 5
+E_POSITION_CHANGED = 6
+
+# game_state keys a move_made delta leaves out: the board goes as changed squares, history as the new entry
+_DELTA_EXCLUDED = frozenset(('board', 'move_history'))
+
+# "row,col" keys used by the client's valid-move maps, built once
+_SQUARE_KEYS = {(row, col): f"{row},{col}" for row in range(8) for col in range(8)}
+
+def moves_to_client(valid_moves: dict) -> dict:
+    """Convert ChessGame.calculate_moves() output to the client's {"row,col": [(row, col), ...]} shape"""
+    # calculate_moves already returns fresh lists of (row, col) targets; only the keys change
+    return {_SQUARE_KEYS[square]: moves for square, moves in valid_moves.items()}
+
 class GameHandler:
     def __init__(self):
         self.state = GlobalState.get_instance()
-        self.draw_offer_history = {}  # Track draw offer rate limiting
+        # Track draw offer rate limiting: client_id -> monotonic_ns stamps of recent offers
+        self.draw_offer_history: Dict[str, deque] = defaultdict(lambda: deque(maxlen=DRAW_OFFER_LIMIT))
+        # ChessGame.zobrist_hash() -> client valid moves, least recently used first.
+        # Entries are shared by every response that hits them, so they are never mutated
+        self.move_cache: OrderedDict = OrderedDict()
+        self.move_cache_size = 2048
+
+    @staticmethod
+    def lobby_game(lobby) -> ChessGame:
+        """The lobby's live ChessGame, rebuilt from lobby.game_state after the lobby was (re)loaded"""
+        if lobby.game is None:
+            lobby.game = ChessGame().load_from_state(lobby.game_state)
+        return lobby.game
+
+    async def _client_moves(self, game: ChessGame) -> dict:
+        """Client valid moves for game, from move_cache when the position has been seen before"""
+        key = game.zobrist_hash()
+        client_moves = self.move_cache.get(key)
+        if client_moves is not None:
+            self.move_cache.move_to_end(key)
+            return client_moves
+        client_moves = await asyncio.to_thread(self._calculate_client_moves, game)
+        self.move_cache[key] = client_moves
+        if len(self.move_cache) > self.move_cache_size:
+            self.move_cache.popitem(last=False)
+        return client_moves
+
+    def _superseded(self, lobby, read_state: dict) -> bool:
+        """Whether the lobby's game has moved on since read_state was read.
 
-    async def handle_move(self, client_id: str, websocket, game_state: dict, data: dict):
-        """Handle a move request"""
+        Checked after an await, before a handler stores a state it derived from
+        read_state: a move, resign, draw or timeout stored meanwhile must not be overwritten.
+        """
+        current = self.state.get_lobby(lobby.code)
+        if current is None or not current.game_state or current.game_state.get('game_over'):
+            return True
+        if current.game_state is read_state:
+            return False
+        # The lobby was reloaded or the state replaced; compare what any write would change
+        stored = current.game_state
+        return (len(stored.get('move_history', ())) != len(read_state.get('move_history', ())) or
+                stored.get('current_turn') != read_state.get('current_turn') or
+                bool(stored.get('promotion_pending')) != bool(read_state.get('promotion_pending')))
+
+    @staticmethod
+    def _calculate_client_moves(game: ChessGame) -> dict:
+        """Legal moves for the side to move, keyed "row,col" as the client expects"""
+        return moves_to_client(game.calculate_moves())
+
+    async def handle_move(self, client_id: str, websocket, lobby, data: dict):
+        """Handle a move request in lobby, storing the resulting state; move_made replies carry only the delta"""
+        game_state = read_state = lobby.game_state
         from_pos = tuple(data['from'])
         to_pos = tuple(data['to'])
         
-        # Create a game instance from the game state
-        game = ChessGame()
-        game.load_from_state(game_state)  # We need to add this method to ChessGame
-        
         if game_state.get('game_over'):
-            return {'type': 'invalid_move', 'reason': 'Game is over'}
-            
+            return {
+                'type': 'invalid_move',
+                'code': E_GAME_OVER,
+                'reason': 'Game is over',
+                'from': from_pos,
+                'to': to_pos,
+                'current_turn': game_state.get('current_turn')
+            }
+        
+        # The promoting player has to choose (promotion_choice) before any other move
+        if game_state.get('promotion_pending'):
+            return {
+                'type': 'invalid_move',
+                'code': E_PROMOTION_PENDING,
+                'reason': 'Promotion pending',
+                'from': from_pos,
+                'to': to_pos,
+                'current_turn': game_state['current_turn']
+            }
+        
+        # valid_moves stored with the state are the legal moves for this position;
+        # anything outside them is rejected before the board or clock is touched
+        legal_moves = game_state.get('valid_moves')
+        if legal_moves is not None:
+            legal_targets = legal_moves.get(_SQUARE_KEYS.get(from_pos), ())
+            if to_pos not in legal_targets and list(to_pos) not in legal_targets:
+                return self._invalid_move_response(game_state, from_pos, to_pos, legal_targets)
+        
+        # The move is tried on a copy of the live game; the lobby only sees it once the
+        # resulting state is stored, so a rejected or failed move leaves both untouched
+        game = self.lobby_game(lobby).copy()
+        
+        # game_state belongs to the cached lobby; clock updates go on a copy so a
+        # rejected move leaves the stored state untouched
+        game_state = dict(game_state)
+        if game_state.get('clock'):
+            game_state['clock'] = dict(game_state['clock'])
+
         # Update clock for the last turn if it exists
         if game_state.get('clock'):
-            # Use UTC time to avoid timezone issues
-            now = datetime.datetime.utcnow().isoformat() + 'Z'
+            # last_turn_start is epoch milliseconds (UTC); the client and TimerManager read it as-is
+            now_ms = time.time_ns() // 1_000_000
             clock = game_state['clock']
             last_turn = clock.get('last_turn_start')
             
@@ -39,31 +147,8 @@ class GameHandler:
             current_moving_player = game_state['current_turn'] 
                 
             if last_turn:
-                now_dt = datetime.datetime.utcnow()
-                if isinstance(last_turn, str):
-                    try:
-                        # Handle both with and without 'Z' suffix for UTC
-                        last_turn_clean = last_turn.rstrip('Z')
-                        last_dt = datetime.datetime.fromisoformat(last_turn_clean)
-                        elapsed = (now_dt - last_dt).total_seconds() * 1000
-                    except Exception:
-                        # If string parsing fails, try to convert to float timestamp
-                        try:
-                            elapsed = now_dt.timestamp() * 1000 - float(last_turn)
-                        except:
-                            elapsed = 0  # Skip this update if we can't parse
-                else:
-                    # Handle numeric timestamp (either in seconds or milliseconds)
-                    try:
-                        timestamp = float(last_turn)
-                        # Check if timestamp is in seconds (Unix timestamp) or milliseconds
-                        if timestamp > 1e12:  # If greater than 1e12, assume milliseconds
-                            elapsed = now_dt.timestamp() * 1000 - timestamp
-                        else:  # Otherwise assume seconds
-                            elapsed = now_dt.timestamp() - timestamp
-                            elapsed *= 1000  # Convert to milliseconds
-                    except:
-                        elapsed = 0  # Skip this update if we can't parse
+                # Lobbies are loaded with last_turn_start already in epoch ms
+                elapsed = now_ms - last_turn
                 # Update the time for the player who is making this move (current_moving_player)
                 if current_moving_player == 'white':
                     # print(f"[CLOCK] White completed turn - before: {clock['white_ms']}, elapsed: {elapsed}, increment: {clock.get('increment_ms')}") # debug
@@ -84,13 +169,18 @@ class GameHandler:
                         clock['black_ms'] += clock['increment_ms']
                     # print(f"[CLOCK] Black after update: {clock['black_ms']}") # debug
             # Update last turn start time
-            clock['last_turn_start'] = now
+            clock['last_turn_start'] = now_ms
         
         if game.move_piece(from_pos, to_pos):
             # print(f"Move successful! Turn after move: {game.current_turn.value}") # debug
             
-            # Get updated game state
-            new_state = game.get_board_state()
+            # Get updated game state. game_state's board matches the board before this move,
+            # so only the squares the move changed are serialized again
+            squares = game.pop_change_log()
+            board = [list(row) for row in game_state['board']]
+            for row, col, piece in squares:
+                board[row][col] = piece
+            new_state = game.get_board_state(board)
             # print(f"New state current_turn: {new_state['current_turn']}") # debug
             
             # Merge clock information
@@ -99,27 +189,35 @@ class GameHandler:
             
             # Check for promotion first
             if game.promotion_pending:
+                self.state.update_lobby_game_state(lobby.code, new_state, game)
                 # Send promotion pending message
                 return {
                     'type': 'promotion_pending',
                     'game_state': new_state
                 }
             
-            # Calculate valid moves for the new state
-            valid_moves = game.calculate_moves()
-            print(f"Calculated {len(valid_moves)} valid move groups for {game.current_turn.value}")
-            
-            # Convert moves for client
-            client_moves = {
-                f"{row},{col}": [(to_row, to_col) for to_row, to_col in moves]
-                for (row, col), moves in valid_moves.items()
-            }
+            # Calculate valid moves for the new state (off the event loop on a cache miss;
+            # game is this handler's own copy, so nothing else sees the board meanwhile)
+            client_moves = await self._client_moves(game)
+            if self._superseded(lobby, read_state):
+                current = self.state.get_lobby(lobby.code)
+                current = current.game_state if current and current.game_state else {}
+                over = bool(current.get('game_over'))
+                return {
+                    'type': 'invalid_move',
+                    'code': E_GAME_OVER if over else E_POSITION_CHANGED,
+                    'reason': 'Game is over' if over else 'Position changed',
+                    'from': from_pos,
+                    'to': to_pos,
+                    'current_turn': current.get('current_turn')
+                }
+            logger.debug("Calculated %d valid move groups for %s", len(client_moves), game.current_turn.value)
             
             # Always add valid moves to game state for frontend
             new_state['valid_moves'] = client_moves
             
             # Check for game over (checkmate/stalemate)
-            if not valid_moves:
+            if not client_moves:
                 reason = None
                 # Check if current turn king is in check
                 if ((new_state.get('current_turn') == 'white' and new_state.get('white_king_in_check')) or 
@@ -129,13 +227,13 @@ class GameHandler:
                 else:
                     reason = 'stalemate'
                     new_state['winner'] = None  
+                self.state.update_lobby_game_state(lobby.code, new_state, game)
                 # First send move_made
                 
                 # Then send game_over
                 return [{
                     'type': 'move_made',
-                    'game_state': new_state,
-                    'valid_moves': client_moves,
+                    'delta': self._move_delta(new_state, squares),
                     'last_move': {'from': from_pos, 'to': to_pos}
                 },
                 {
@@ -143,37 +241,76 @@ class GameHandler:
                     'reason': reason,
                     'game_state': new_state
                 }]
-            # Send updated game state and new valid moves
+            self.state.update_lobby_game_state(lobby.code, new_state, game)
+            # Send what the move changed; players keep their own copy of the game state
             return {
                 'type': 'move_made',
-                'game_state': new_state,
-                'valid_moves': client_moves,
+                'delta': self._move_delta(new_state, squares),
                 'last_move': {'from': from_pos, 'to': to_pos}
             }
         
-        # Move failed - provide detailed debugging information
+        return self._invalid_move_response(game_state, from_pos, to_pos)
+    
+    @staticmethod
+    def _move_delta(new_state: dict, squares: list) -> dict:
+        """What move_made sends players: new_state minus the board and history, plus the changed squares and history entry"""
+        delta = {key: value for key, value in new_state.items() if key not in _DELTA_EXCLUDED}
+        delta['squares'] = squares
+        delta['ply'] = len(new_state['move_history'])
+        delta['move'] = new_state['move_history'][-1]
+        return delta
+
+    def _invalid_move_response(self, game_state: dict, from_pos: tuple, to_pos: tuple, legal_targets=None) -> dict:
+        """Build the invalid_move reply; a private game is loaded from game_state only if debug details need it"""
+        # The code only needs the serialized source square; the board is not loaded for it
+        source = game_state['board'][from_pos[0]][from_pos[1]] if from_pos in _SQUARE_KEYS else None
+        if source is None:
+            code = E_NO_PIECE
+        elif source['color'] != game_state['current_turn']:
+            code = E_WRONG_TURN
+        else:
+            code = E_ILLEGAL_MOVE
+        
+        # Detailed debugging information is only worth building when someone will
+        # read it; otherwise reply straight away with empty details
+        error_details = []
+        if logger.isEnabledFor(logging.DEBUG):
+            game = ChessGame().load_from_state(game_state)
+            error_details = self._describe_invalid_move(game, from_pos, to_pos, legal_targets)
+        
+        return {
+            'type': 'invalid_move',
+            'code': code,
+            'reason': 'Move validation failed',
+            'details': error_details,
+            'from': from_pos,
+            'to': to_pos,
+            'current_turn': game_state['current_turn']
+        }
+    
+    def _describe_invalid_move(self, game: ChessGame, from_pos: tuple, to_pos: tuple, legal_targets=None) -> list:
+        """Explain why a move was rejected (debug only), using the legal targets of from_pos when known"""
         from_row, from_col = from_pos
         to_row, to_col = to_pos
         piece = game.get_piece_at(from_row, from_col)
         target_piece = game.get_piece_at(to_row, to_col)
         
-        print(f"Move failed! Current turn in game: {game.current_turn.value}")
-        print(f"Attempting to move {piece.color.value if piece else 'None'} piece")
+        logger.debug("Move failed! Current turn in game: %s", game.current_turn.value)
+        logger.debug("Attempting to move %s piece", piece.color_str if piece else 'None')
         
-        # Build detailed error message
         error_details = []
         
         if not piece:
             error_details.append(f"No piece at source position ({from_row},{from_col})")
         else:
-            error_details.append(f"Piece at source: {piece.color.value} {piece.type.value}")
-            error_details.append(f"Piece abilities: {[a.value for a in piece.abilities]}")
+            error_details.append(f"Piece at source: {piece.color_str} {piece.type_str}")
+            error_details.append(f"Piece abilities: {piece.ability_strs()}")
             
             if piece.color != game.current_turn:
-                error_details.append(f"Wrong turn - current turn: {game.current_turn.value}, piece color: {piece.color.value}")
+                error_details.append(f"Wrong turn - current turn: {game.current_turn.value}, piece color: {piece.color_str}")
         
         if target_piece:
-            error_details.append(f"Target piece: {target_piece.color.value} {target_piece.type.value}")
+            error_details.append(f"Target piece: {target_piece.color_str} {target_piece.type_str}")
             if piece and target_piece.color == piece.color:
                 error_details.append("Cannot capture own piece")
         
@@ -192,43 +329,23 @@ class GameHandler:
                     valid_for_abilities.append(ability.value)
             
             if not valid_for_abilities:
-                error_details.append(f"Move {from_pos} -> {to_pos} not valid for any abilities: {[a.value for a in piece.abilities]}")
+                error_details.append(f"Move {from_pos} -> {to_pos} not valid for any abilities: {piece.ability_strs()}")
             else:
                 error_details.append(f"Move valid for abilities: {valid_for_abilities}")
                 
-                # Check if king would be in check
-                # Simulate the move
-                captured_piece = game.get_piece_at(to_row, to_col)
-                game.board[to_row][to_col] = piece
-                game.board[from_row][from_col] = None
-                original_position = piece.position
-                piece.position = (to_row, to_col)
-                king_in_check = game._is_king_in_check(piece.color)
-                # Revert
-                game.board[from_row][from_col] = piece
-                game.board[to_row][to_col] = captured_piece
-                piece.position = original_position
-                
-                if king_in_check:
-                    error_details.append("Move would put own king in check")
+                # calculate_moves already drops moves that leave the own king in check,
+                # so a pattern-valid move missing from the legal targets is one of those
+                if piece.color == game.current_turn:
+                    if legal_targets is None:
+                        legal_targets = game.calculate_moves().get(from_pos, ())
+                    if to_pos not in legal_targets and list(to_pos) not in legal_targets:
+                        error_details.append("Move would put own king in check")
         
-        return {
-            'type': 'invalid_move',
-            'reason': 'Move validation failed',
-            'details': error_details,
-            'from': from_pos,
-            'to': to_pos,
-            'current_turn': game.current_turn.value
-        }
-    
+        return error_details
+
     async def handle_valid_moves_request(self, client_id: str, websocket, game: ChessGame):
         """Handle request for valid moves"""
-        valid_moves = game.calculate_moves()
-        # Convert moves for client
-        client_moves = {
-            f"{row},{col}": [(to_row, to_col) for to_row, to_col in moves]
-            for (row, col), moves in valid_moves.items()
-        }
+        client_moves = await self._client_moves(game)
         return {
             'type': 'valid_moves',
             'moves': client_moves
@@ -246,13 +363,7 @@ class GameHandler:
             return None
 
         # Find the resigning player in the lobby
-        resigning_player = None
-        for player in lobby.players:
-            if player.id == client_id:
-                resigning_player = player
-                break
-
-
+        resigning_player = lobby.players_by_id.get(client_id)
         if not resigning_player:
             return None
         
@@ -284,7 +395,7 @@ class GameHandler:
         lobby.game_state['timeout_player'] = current_turn
         
         # Update in database to prevent race conditions
-        self.state.update_lobby_game_state(lobby.code, lobby.game_state)
+        self.state.update_lobby_game_fields(lobby.code, {'game_over': True, 'winner': winner, 'timeout_player': current_turn})
         
         return {
             'type': 'game_over',
@@ -295,22 +406,22 @@ class GameHandler:
 
     async def handle_offer_draw(self, client_id: str, websocket):
         """Handle draw offer with rate limiting"""
-        now = datetime.datetime.utcnow()
+        now = time.monotonic_ns()
         
-        # Rate limit: max 3 offers per minute per player
-        history = self.draw_offer_history.setdefault(client_id, [])
-        history = [t for t in history if (now - t).total_seconds() <= 60]
-        self.draw_offer_history[client_id] = history
+        # Rate limit: max 3 offers per minute per player. Stamps are oldest first,
+        # so expired ones are dropped from the left
+        history = self.draw_offer_history[client_id]
+        while history and now - history[0] > DRAW_OFFER_WINDOW_NS:
+            history.popleft()
         
-        if len(history) >= 3:
+        if len(history) >= DRAW_OFFER_LIMIT:
             return {
                 'type': 'draw_offer_rate_limited',
-                'retry_after': 60 - int((now - history[0]).total_seconds())
+                'retry_after': 60 - (now - history[0]) // 1_000_000_000
             }
             
         # Record this offer time
         history.append(now)
-        self.draw_offer_history[client_id] = history
         
         lobby = self.state.get_lobby_by_client(client_id)
         if not lobby or not lobby.game_state or lobby.game_state.get('game_over'):
@@ -354,9 +465,9 @@ class GameHandler:
         if not choice:
             return None
             
-        # Reconstruct game from state
-        game = ChessGame()
-        game.load_from_state(lobby.game_state)
+        # Like handle_move, work on a copy that replaces the live game once stored
+        read_state = lobby.game_state
+        game = self.lobby_game(lobby).copy()
         
         if not game.promotion_pending:
             return None
@@ -364,13 +475,15 @@ class GameHandler:
         if choice.lower() == 'cancel':
             if lobby.game_state.get('promotion_cancel_allowed'):
                 if game.cancel_promotion():
+                    # The full state goes out, so the changed squares are not needed for a delta
+                    game.pop_change_log()
                     new_state = game.get_board_state()
                     # Merge clock information
                     if lobby.game_state.get('clock'):
                         new_state['clock'] = lobby.game_state['clock']
                     
                     # Update lobby state
-                    self.state.update_lobby_game_state(lobby.code, new_state)
+                    self.state.update_lobby_game_state(lobby.code, new_state, game)
                     
                     return {
                         'type': 'promotion_canceled',
@@ -398,12 +511,12 @@ class GameHandler:
             # apply_promotion already switches turns, no need to do it again
             
             # Calculate valid moves for the new state
-            valid_moves = game.calculate_moves()
-            client_moves = {
-                f"{r},{c}": [(to_row, to_col) for to_row, to_col in moves]
-                for (r, c), moves in valid_moves.items()
-            }
+            client_moves = await self._client_moves(game)
+            if self._superseded(lobby, read_state):
+                return None
             
+            # The full state goes out, so the changed squares are not needed for a delta
+            game.pop_change_log()
             new_state = game.get_board_state()
             new_state['valid_moves'] = client_moves
             
@@ -411,11 +524,8 @@ class GameHandler:
             if lobby.game_state.get('clock'):
                 new_state['clock'] = lobby.game_state['clock']
             
-            # Update lobby state
-            self.state.update_lobby_game_state(lobby.code, new_state)
-            
             # Check for game over after promotion
-            if not valid_moves:
+            if not client_moves:
                 reason = None
                 if ((new_state.get('current_turn') == 'white' and new_state.get('white_king_in_check')) or 
                     (new_state.get('current_turn') == 'black' and new_state.get('black_king_in_check'))):
@@ -425,12 +535,15 @@ class GameHandler:
                     reason = 'stalemate'
                     new_state['winner'] = None
                 
+                self.state.update_lobby_game_state(lobby.code, new_state, game)
                 return {
                     'type': 'game_over',
                     'reason': reason,
                     'game_state': new_state
                 }
                 
+            # Update lobby state
+            self.state.update_lobby_game_state(lobby.code, new_state, game)
             return {
                 'type': 'promotion_applied',
                 'game_state': new_state,
@@ -445,5 +558,5 @@ class GameHandler:
         DEPRECATED: Bot move handling moved to frontend
         Bot games are now handled entirely on the client side using WebAssembly engine
         """
-        print("[BOT] Backend bot handling disabled - using frontend bot instead")
+        logger.debug("[BOT] Backend bot handling disabled - using frontend bot instead")
         return None
\ No newline at end of file
@@ -1,11 +1,13 @@
 import asyncio
 import datetime
+import time
 import uuid
 from typing import Dict, Optional
 from server.core.models import Lobby, Player, BotPlayer
 from server.core.enums import Color
 from server.core.game import ChessGame
 from server.core.state import GlobalState
+from server.handlers.game_handler import moves_to_client
 import random
 import string
 #from server.networking.connection import ConnectionManager
@@ -37,25 +39,27 @@ class LobbyHandler:
         
         players = [Player(client_id, player_name, Color.WHITE, websocket)]
         
-        # Add bot if requested
-        if with_bot:
-            bot_id = f"bot_{lobby_code}"
-            bot_player = BotPlayer(bot_id, "Chess Bot", Color.BLACK)
-            players.append(bot_player)
-            # Add bot to client_lobby_map
-            self.state.add_player_to_lobby(bot_id, lobby_code, Color.BLACK.value)
-        
-        lobby = Lobby(
-            code=lobby_code,
-            owner_id=client_id,
-            players=players,
-            game_state=None,
-            settings=data.get('settings', {}),
-            created_at=datetime.datetime.now(),
-            has_bot=with_bot
-        )
-        
-        self.state.add_lobby(lobby_code, lobby)
+        # The bot mapping and the lobby itself are written in one transaction
+        with self.state.transaction():
+            # Add bot if requested
+            if with_bot:
+                bot_id = f"bot_{lobby_code}"
+                bot_player = BotPlayer(bot_id, "Chess Bot", Color.BLACK)
+                players.append(bot_player)
+                # Add bot to client_lobby_map
+                self.state.add_player_to_lobby(bot_id, lobby_code, Color.BLACK.value)
+            
+            lobby = Lobby(
+                code=lobby_code,
+                owner_id=client_id,
+                players=players,
+                game_state=None,
+                settings=data.get('settings', {}),
+                created_at=datetime.datetime.now(),
+                has_bot=with_bot
+            )
+            
+            self.state.add_lobby(lobby_code, lobby)
         
         return {
             'type': 'lobby_created',
@@ -110,13 +114,8 @@ class LobbyHandler:
                        for p in lobby.players],
             'settings': lobby.settings
         }
-        # Send lobby update to all remaining players
-        for p in lobby.players:
-            if hasattr(p, 'websocket') and p.websocket:
-                # Add is_owner specific to each player
-                player_specific_update = lobby_update.copy()
-                player_specific_update['is_owner'] = p.id == lobby.owner_id
-                await self.connection_manager.send_message(p.websocket, player_specific_update)
+        # Send lobby update to all remaining players, with is_owner specific to each player
+        await self.connection_manager.send_with_owner_flag(lobby, lobby_update)
         return lobby_update
 
 
@@ -137,7 +136,7 @@ class LobbyHandler:
         
         player_color = Color.BLACK if len(lobby.players) == 1 else Color.WHITE
         player = Player(client_id, player_name, player_color, websocket)
-        lobby.players.append(player)
+        lobby.add_player(player)
         
         # Add player to lobby mapping with their color
         self.state.add_player_to_lobby(client_id, lobby_code, player_color.value)
@@ -186,15 +185,10 @@ class LobbyHandler:
                 game = ChessGame()
                 
                 # Calculate initial valid moves
-                valid_moves = game.calculate_moves()
-                client_moves = {
-                    f"{row},{col}": [(to_row, to_col) for to_row, to_col in moves]
-                    for (row, col), moves in valid_moves.items()
-                }
+                client_moves = moves_to_client(game.calculate_moves())
                 
-                # Get game state with clocks
-                lobby.game_state = game.get_board_state()
-                self.state.update_lobby_game_state(lobby.code, lobby.game_state)
+                # Get game state with clocks; it is completed below and stored in one write
+                game_state = game.get_board_state()
                 
                 # Setup clock information based on lobby settings
                 time_minutes = lobby.settings.get('time_minutes', 0)
@@ -205,24 +199,24 @@ class LobbyHandler:
                 increment_ms = increment_seconds * 1000 if increment_seconds else 0
                 
                 # Add clock information to game state
-                # Use UTC time to avoid timezone issues
-                now_iso = datetime.datetime.utcnow().isoformat() + 'Z'
-                # print(f"[LOBBY DEBUG] Setting last_turn_start to: {now_iso} (type: {type(now_iso)})")
-                lobby.game_state['clock'] = {
+                # Epoch milliseconds, so per-move clock math is plain int arithmetic
+                now_ms = time.time_ns() // 1_000_000
+                # print(f"[LOBBY DEBUG] Setting last_turn_start to: {now_ms}")
+                game_state['clock'] = {
                     'white_ms': time_ms if time_ms is not None else 0,
                     'black_ms': time_ms if time_ms is not None else 0,
                     'increment_ms': increment_ms,
-                    'last_turn_start': now_iso
+                    'last_turn_start': now_ms
                 }
-                # print(f"[LOBBY DEBUG] Clock data set: {lobby.game_state['clock']}")
-                self.state.update_lobby_game_state(lobby.code, lobby.game_state)
+                # print(f"[LOBBY DEBUG] Clock data set: {game_state['clock']}")
                 
                 # Add game state info
-                lobby.game_state['valid_moves'] = client_moves
-                lobby.game_state['current_turn'] = 'white'
-                lobby.game_state['game_over'] = False
-                lobby.game_state['winner'] = None
-                self.state.update_lobby_game_state(lobby.code, lobby.game_state)
+                game_state['valid_moves'] = client_moves
+                game_state['current_turn'] = 'white'
+                game_state['game_over'] = False
+                game_state['winner'] = None
+                lobby.game_state = game_state
+                self.state.update_lobby_game_state(lobby.code, game_state, game)
                 
                 # Send game started message to both players
                 for player in lobby.players:
@@ -239,7 +233,7 @@ class LobbyHandler:
                             'lobby_code': lobby.code
                         }
                     }
-                    if hasattr(player, 'websocket') and player.websocket:  # Check for bot players
+                    if player.websocket:  # None for bot players
                         await self.connection_manager.send_message(player.websocket, response)
                 
                 # Check if bot should make the first move (white always goes first)
@@ -265,7 +259,7 @@ class LobbyHandler:
         lobby = self.state.get_lobby_by_client(client_id)
         if lobby:
             # Remove player from lobby
-            lobby.players = [p for p in lobby.players if p.id != client_id]
+            lobby.remove_player(client_id)
             
             # Remove player from lobby mapping
             self.state.remove_player_from_lobby(client_id)
@@ -351,6 +345,4 @@ class LobbyHandler:
         if move_result:
             lobby = self.state.get_lobby(lobby_code)
             if lobby:
-                for player in lobby.players:
-                    if hasattr(player, 'websocket') and player.websocket:  # Check for bot players
-                        await self.connection_manager.send_message(player.websocket, move_result)
\ No newline at end of file
+                await self.connection_manager.broadcast(lobby.players, move_result)
\ No newline at end of file
@@ -17,11 +17,13 @@ class SearchHandler:
         """Handle a player searching for a game"""
         player_name = data.get('player_name', 'Player')
 
-        # Check if player is already in a lobby
-        existing_lobby = self.state.get_lobby_by_client(client_id)
+        # Check if player is already in a lobby (only its game state matters here)
+        existing_code = self.state.get_lobby_code_by_client(client_id)
+        existing_lobby = self.state.get_lobby_summary(existing_code) if existing_code else None
         if existing_lobby:
             # If the game is over, remove the player from the old lobby to allow new search
-            if existing_lobby.game_state and existing_lobby.game_state.get('game_over'):
+            game_state = existing_lobby['game_state']
+            if game_state and game_state.get('game_over'):
                 # Leave the finished lobby
                 await self.lobby_handler.leave_lobby(client_id, websocket)
             else:
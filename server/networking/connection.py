@@ -1,4 +1,5 @@
 import asyncio
+import logging
 import uuid
 import websockets
 import datetime
@@ -6,7 +7,12 @@ from typing import Dict
 from server.core.game import ChessGame
 from server.core.state import GlobalState
 from server.handlers.game_handler import GameHandler
-import json
+from server.core import jsonutil
+
+logger = logging.getLogger(__name__)
+
+# Maximum sends gathered at once before yielding back to the event loop
+BROADCAST_BATCH_SIZE = 50
 
 
 class ConnectionManager:
@@ -24,9 +30,10 @@ class ConnectionManager:
    
     
     async def send_message(self, websocket, message):
-        """Send a message to a specific websocket"""
+        """Send a message (a dict, or a payload already encoded with jsonutil.dumps) to a specific websocket"""
+        payload = message if isinstance(message, str) else jsonutil.dumps(message)
         try:
-            await websocket.send(json.dumps(message))
+            await websocket.send(payload)
         except websockets.exceptions.ConnectionClosed:
             pass
             
@@ -50,14 +57,12 @@ class ConnectionManager:
         finally:
             # Don't immediately remove from connected_clients - let auto-resign handle cleanup
             # Just close the websocket but keep the client in connected_clients for auto-resign
-            if client_id in self.state.connected_clients:
+            websocket = self.state.detach_client_websocket(client_id)
+            if websocket:
                 try:
-                    websocket = self.state.connected_clients[client_id]
                     await websocket.close()
                 except Exception:
                     pass
-                # Mark websocket as None to indicate disconnection, but keep the entry
-                self.state.connected_clients[client_id] = None
             
             # Call handle_disconnect - it will manage the cleanup timing
             await self.handle_disconnect(client_id)
@@ -66,34 +71,66 @@ class ConnectionManager:
     
     async def broadcast_to_lobby_clients(self, lobby_code: str, message: dict, exclude_client_id: str = None):
         """Send a message to all clients in the specified lobby except the excluded one"""
-        lobby = self.state.get_lobby(lobby_code)
+        lobby = await self.state.aget_lobby(lobby_code)
         if not lobby:
             return
         
+        payload = jsonutil.dumps(message)
         sent_count = 0
         for player in lobby.players:
             if player.id != exclude_client_id:
                 # Use the player's websocket directly (from the reconstructed lobby)
                 # This will be None for disconnected players, which is correct
-                ws = player.websocket if hasattr(player, 'websocket') else None
+                ws = player.websocket
                 if ws:  # Only send to clients with active websockets
                     try:
-                        await ws.send(json.dumps(message))
+                        await ws.send(payload)
                         sent_count += 1
                     except Exception as e:
-                        print(f"[BROADCAST] Failed to send to player {player.id}: {e}")
+                        logger.warning("[BROADCAST] Failed to send to player %s: %s", player.id, e)
         
         if sent_count > 0:
-            print(f"[BROADCAST] Sent {message.get('type', 'unknown')} message to {sent_count} players in lobby {lobby_code}")
+            logger.debug("[BROADCAST] Sent %s message to %d players in lobby %s", message.get('type', 'unknown'), sent_count, lobby_code)
         else:
-            print(f"[BROADCAST] No connected players found in lobby {lobby_code} to send {message.get('type', 'unknown')} message")
+            logger.debug("[BROADCAST] No connected players found in lobby %s to send %s message", lobby_code, message.get('type', 'unknown'))
+
+    async def broadcast(self, players, message, batch_size: int = BROADCAST_BATCH_SIZE):
+        """Send one message to every connected player concurrently.
+
+        The message is encoded once. Large fan-outs go out in batches, with a
+        yield to the event loop between batches so other clients are not starved.
+        Sends go through GlobalState.send_to_clients, so failures are logged and
+        stalled peers closed the same way as for broadcast_to_clients.
+        """
+        payload = message if isinstance(message, str) else jsonutil.dumps(message)
+        recipients = [(p.id, p.websocket) for p in players if p.websocket]  # None for bot players
+        for start in range(0, len(recipients), batch_size):
+            if start:
+                await asyncio.sleep(0)
+            await self.state.send_to_clients(recipients[start:start + batch_size], payload)
+
+    async def send_with_owner_flag(self, lobby, message: dict, exclude_client_id: str = None):
+        """Send a lobby message whose only per-player field is is_owner.
+
+        The owner and non-owner variants are each encoded once, however many
+        players the lobby has.
+        """
+        payloads = {}
+        for player in lobby.players:
+            if player.id == exclude_client_id or not player.websocket:  # None for bot players
+                continue
+            is_owner = player.id == lobby.owner_id
+            payload = payloads.get(is_owner)
+            if payload is None:
+                payload = payloads[is_owner] = jsonutil.dumps({**message, 'is_owner': is_owner})
+            await self.send_message(player.websocket, payload)
 
 
     async def unregister_client(self, client_id: str, remove_from_lobby: bool = True):
         """Unregister a client and clean up"""
-        if client_id in self.state.connected_clients:
+        websocket = self.state.get_client_websocket(client_id)
+        if websocket:
             try:
-                websocket = self.state.connected_clients[client_id]
                 await websocket.close()
             except Exception:
                 pass
@@ -111,8 +148,7 @@ class ConnectionManager:
         abort_time = timestamp + datetime.timedelta(seconds=10)
         
         # Capture lobby code before any cleanup - this is crucial
-        lobby = self.state.get_lobby_by_client(client_id)
-        lobby_code = lobby.code if lobby else None
+        lobby_code = self.state.get_lobby_code_by_client(client_id)
         
         # Only broadcast to clients in the same lobby as the disconnecting player
         if lobby_code:
@@ -139,21 +175,21 @@ class ConnectionManager:
                         response = await self.game_handler.handle_resign(client_id, None, lobby_code)
                         # print(f"[Auto-Resign] handle_resign response: {response}")
                         if response:
+                            self.state.update_lobby_game_state(lobby_code, response['game_state'])
                             response['reason'] = 'disconnect'
                             # print(f"[Auto-Resign] broadcasting to lobby_code: {lobby_code}")
                             await self.broadcast_to_lobby_clients(lobby_code, response)
                 
                 # NOW clean up everything - after auto-resign is complete
-                print(f"[Auto-Resign] Cleaning up client {client_id}")
+                logger.debug("[Auto-Resign] Cleaning up client %s", client_id)
                 # Remove from connected_clients (was set to None during disconnect)
-                if client_id in self.state.connected_clients:
-                    del self.state.connected_clients[client_id]
+                self.state.forget_client(client_id)
                 # Only remove from lobby AFTER auto-resign has been processed
                 await self.unregister_client(client_id, remove_from_lobby=True)
                 
             except asyncio.CancelledError:
                 # If cancelled (reconnected), don't clean up - client is still active
-                print(f"[Auto-Resign] Cancelled for client {client_id} - client reconnected")
+                logger.debug("[Auto-Resign] Cancelled for client %s - client reconnected", client_id)
             finally:
                 # Remove from auto_resign_tasks
                 if client_id in self.auto_resign_tasks:
@@ -168,12 +204,11 @@ class ConnectionManager:
         if client_id in self.auto_resign_tasks:
             self.auto_resign_tasks[client_id].cancel()
             del self.auto_resign_tasks[client_id]
-            print(f"[Reconnection] Cancelled auto-resign for {client_id}")
+            logger.debug("[Reconnection] Cancelled auto-resign for %s", client_id)
         
-        if client_id in self.state.connected_clients:
+        if self.state.is_client_connected(client_id):
             timestamp = datetime.datetime.now()
-            lobby = self.state.get_lobby_by_client(client_id)
-            lobby_code = lobby.code if lobby else None
+            lobby_code = self.state.get_lobby_code_by_client(client_id)
             if lobby_code:
                 await self.broadcast_to_lobby_clients(lobby_code, {
                     'type': 'player_reconnected',
@@ -185,13 +220,13 @@ class ConnectionManager:
         """Handle incoming messages from a client"""
         async for message in websocket:
             try:
-                data = json.loads(message)
+                data = jsonutil.loads(message)
                 
                 # Forward game-specific messages to the handler
                 if self.message_handler:
                     await self.message_handler(client_id, websocket, data)
                     
-            except json.JSONDecodeError:
+            except jsonutil.JSONDecodeError:
                 # print(f"Invalid JSON from {client_id}")
                 await self.send_message(websocket, {
                     'type': 'error',
@@ -212,10 +247,3 @@ class ConnectionManager:
         """Send a message to all connected clients except the excluded one"""
         await self.state.broadcast_to_clients(message, exclude_client_id)
 
-    async def send_message(self, websocket, message):
-        """Send a message to a specific websocket"""
-        try:
-            await websocket.send(json.dumps(message))
-        except websockets.exceptions.ConnectionClosed:
-            pass
-
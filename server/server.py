@@ -1,6 +1,6 @@
 import asyncio
+import logging
 import websockets
-import json
 from typing import Dict, Optional
 
 from server.networking.connection import ConnectionManager
@@ -8,9 +8,12 @@ from server.handlers.lobby_handler import LobbyHandler
 from server.handlers.game_handler import GameHandler
 from server.handlers.search_handler import SearchHandler
 from server.core.state import GlobalState
+from server.core import jsonutil
 from server.core.game import ChessGame
 from server.checkers.timer_manager import TimerManager
 
+logger = logging.getLogger(__name__)
+
 class GameServer:
     def __init__(self, host: str = "0.0.0.0", port: int = 8765):
         self.host = host
@@ -23,17 +26,19 @@ class GameServer:
         self.search_handler = SearchHandler(self.connection_manager, self.lobby_handler)
         self.state = GlobalState.get_instance()
         self.timer_manager = TimerManager(self.handle_timeout)
+        self.state_flush_interval = 2.0  # Seconds between write-behind flushes of in-memory state
         
     async def handle_timeout(self, lobby_code: str, timed_out_player: str, winner: str):
         """Handle automatic timeout from timer manager"""
-        print(f"[TIMEOUT] Handling timeout for lobby {lobby_code}, timed_out_player: {timed_out_player}, winner: {winner}")
+        logger.info("[TIMEOUT] Handling timeout for lobby %s, timed_out_player: %s, winner: %s", lobby_code, timed_out_player, winner)
         lobby = self.state.get_lobby(lobby_code)
         if not lobby or not lobby.game_state:
-            print(f"[TIMEOUT] No lobby or game state found for {lobby_code}")
+            logger.warning("[TIMEOUT] No lobby or game state found for %s", lobby_code)
             return
             
-        print(f"[TIMEOUT] Players in lobby: {[p.id for p in lobby.players]}")
-        print(f"[TIMEOUT] Game over status: {lobby.game_state.get('game_over')}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[TIMEOUT] Players in lobby: %s", [p.id for p in lobby.players])
+            logger.debug("[TIMEOUT] Game over status: %s", lobby.game_state.get('game_over'))
         
         # Ensure the timeout information is in the game state
         lobby.game_state['game_over'] = True
@@ -41,9 +46,9 @@ class GameServer:
         lobby.game_state['timeout_player'] = timed_out_player
         
         # Update the database immediately to prevent infinite timeout loop
-        print(f"[TIMEOUT] Updating database with game_over=True for lobby {lobby_code}")
-        self.state.update_lobby_game_state(lobby_code, lobby.game_state)
-        print(f"[TIMEOUT] Database update completed for lobby {lobby_code}")
+        logger.debug("[TIMEOUT] Updating database with game_over=True for lobby %s", lobby_code)
+        self.state.update_lobby_game_fields(lobby_code, {'game_over': True, 'winner': winner, 'timeout_player': timed_out_player})
+        logger.debug("[TIMEOUT] Database update completed for lobby %s", lobby_code)
         
         # Create timeout message with the current game state
         timeout_message = {
@@ -54,7 +59,7 @@ class GameServer:
             'winner': winner
         }
         
-        print(f"[TIMEOUT] Broadcasting timeout message to lobby {lobby_code}")
+        logger.debug("[TIMEOUT] Broadcasting timeout message to lobby %s", lobby_code)
         await self.connection_manager.broadcast_to_lobby_clients(lobby_code, timeout_message)
         
     async def handle_message(self, client_id: str, websocket, data: dict):
@@ -87,11 +92,7 @@ class GameServer:
                     await self.connection_manager.send_message(websocket, response['join'])
                     
                     # Send broadcast message to existing players (excluding the new player)
-                    for player in lobby.players:
-                        if player.id != client_id:  # Don't send broadcast to joining player
-                            broadcast_msg = response['broadcast'].copy()
-                            broadcast_msg['is_owner'] = player.id == lobby.owner_id  # Set correct owner status
-                            await self.connection_manager.send_message(player.websocket, broadcast_msg)
+                    await self.connection_manager.send_with_owner_flag(lobby, response['broadcast'], exclude_client_id=client_id)
             else:
                 await self.connection_manager.send_message(websocket, {
                     'type': 'error',
@@ -105,19 +106,14 @@ class GameServer:
         elif message_type == 'move_piece':
             lobby = self.lobby_handler.get_lobby_by_client(client_id)
             if lobby and lobby.game_state:
-                responses = await self.game_handler.handle_move(client_id, websocket, lobby.game_state, data)
+                # handle_move stores the new state itself
+                responses = await self.game_handler.handle_move(client_id, websocket, lobby, data)
                 # If the response is not a list, make it a list for uniform processing
                 if not isinstance(responses, list):
                     responses = [responses]
                 for response in responses:
-                    # Update lobby game state if move was successful
-                    if response.get('type') == 'move_made' and response.get('game_state'):
-                        self.state.update_lobby_game_state(lobby.code, response['game_state'])
                     # Special handling for promotion_pending - only send to the player whose turn it is
                     if response.get('type') == 'promotion_pending':
-                        # Update lobby state for promotion_pending too
-                        if response.get('game_state'):
-                            self.state.update_lobby_game_state(lobby.code, response['game_state'])
                         current_turn = response.get('game_state', {}).get('current_turn')
                         for player in lobby.players:
                             # Only send to the player whose turn it is to choose promotion
@@ -127,24 +123,28 @@ class GameServer:
                                 break
                     else:
                         # For all other move responses, send to all players
-                        for player in lobby.players:
-                            if hasattr(player, 'websocket') and player.websocket:  # Check for bot players
-                                await self.connection_manager.send_message(player.websocket, response)
+                        await self.connection_manager.broadcast(lobby.players, response)
                 
                 # After processing all responses, check if bot should move
                 if lobby.has_bot and not lobby.game_state.get('game_over'):
-                    print(f"[DEBUG] Scheduling bot move for lobby {lobby.code}")
+                    logger.debug("Scheduling bot move for lobby %s", lobby.code)
                     # Schedule bot move after a short delay to allow frontend to update
                     asyncio.create_task(self._schedule_bot_move(lobby.code))
                 else:
-                    print(f"[DEBUG] Not scheduling bot move: has_bot={lobby.has_bot}, game_over={lobby.game_state.get('game_over')}")
+                    logger.debug("Not scheduling bot move: has_bot=%s, game_over=%s", lobby.has_bot, lobby.game_state.get('game_over'))
                     
         elif message_type == 'get_valid_moves':
             lobby = self.lobby_handler.get_lobby_by_client(client_id)
             if lobby and lobby.game_state:
-                game_obj = ChessGame()
-                game_obj.load_from_state(lobby.game_state)
-                response = await self.game_handler.handle_valid_moves_request(client_id, websocket, game_obj)
+                # move_made, promotion_applied and start_game already store the moves
+                # for the position they leave behind; only recompute when they are missing
+                cached_moves = lobby.game_state.get('valid_moves')
+                if cached_moves is not None:
+                    response = {'type': 'valid_moves', 'moves': cached_moves}
+                else:
+                    game_obj = ChessGame()
+                    game_obj.load_from_state(lobby.game_state)
+                    response = await self.game_handler.handle_valid_moves_request(client_id, websocket, game_obj)
                 await self.connection_manager.send_message(websocket, response)
                 
         elif message_type == 'resign':
@@ -153,8 +153,7 @@ class GameServer:
                 lobby = self.lobby_handler.get_lobby_by_client(client_id)
                 if lobby:
                     self.state.update_lobby_game_state(lobby.code, response['game_state'])
-                    for player in lobby.players:
-                        await self.connection_manager.send_message(player.websocket, response)
+                    await self.connection_manager.broadcast(lobby.players, response)
                         
         elif message_type == 'offer_draw':
             response = await self.game_handler.handle_offer_draw(client_id, websocket)
@@ -164,9 +163,8 @@ class GameServer:
                     # Send response to appropriate players
                     if response.get('type') == 'draw_offered':
                         # Send to opponent
-                        for player in lobby.players:
-                            if player.id != client_id:
-                                await self.connection_manager.send_message(player.websocket, response)
+                        opponents = [p for p in lobby.players if p.id != client_id]
+                        await self.connection_manager.broadcast(opponents, response)
                         # Send acknowledgment to offerer
                         await self.connection_manager.send_message(websocket, {'type': 'draw_offer_ack'})
                     else:
@@ -179,8 +177,7 @@ class GameServer:
                 lobby = self.lobby_handler.get_lobby_by_client(client_id)
                 if lobby:
                     self.state.update_lobby_game_state(lobby.code, response['game_state'])
-                    for player in lobby.players:
-                        await self.connection_manager.send_message(player.websocket, response)
+                    await self.connection_manager.broadcast(lobby.players, response)
                         
         elif message_type == 'decline_draw':
             response = await self.game_handler.handle_decline_draw(client_id, websocket, data)
@@ -188,42 +185,32 @@ class GameServer:
                 lobby = self.lobby_handler.get_lobby_by_client(client_id)
                 if lobby:
                     # Send to offerer
-                    for player in lobby.players:
-                        if player.id != client_id:
-                            await self.connection_manager.send_message(player.websocket, response)
+                    opponents = [p for p in lobby.players if p.id != client_id]
+                    await self.connection_manager.broadcast(opponents, response)
                             
         elif message_type == 'promotion_choice':
             response = await self.game_handler.handle_promotion_choice(client_id, websocket, data)
             if response:
+                # handle_promotion_choice has already stored the new state
                 lobby = self.lobby_handler.get_lobby_by_client(client_id)
                 if lobby:
-                    self.state.update_lobby_game_state(lobby.code, response['game_state'])
-                    for player in lobby.players:
-                        await self.connection_manager.send_message(player.websocket, response)
+                    await self.connection_manager.broadcast(lobby.players, response)
                         
         elif message_type == 'swap_colors':
             response = await self.lobby_handler.swap_colors(client_id, websocket, data)
             if response:
                 lobby = self.lobby_handler.get_lobby_by_client(client_id)
                 if lobby:
-                    for player in lobby.players:
-                        if hasattr(player, 'websocket') and player.websocket:  # Check for bot players
-                            # Personalize is_owner for each player
-                            player_response = response.copy()
-                            player_response['is_owner'] = player.id == lobby.owner_id
-                            await self.connection_manager.send_message(player.websocket, player_response)
+                    # Personalize is_owner for each player
+                    await self.connection_manager.send_with_owner_flag(lobby, response)
                             
         elif message_type == 'randomize_colors':
             response = await self.lobby_handler.randomize_colors(client_id, websocket, data)
             if response:
                 lobby = self.lobby_handler.get_lobby_by_client(client_id)
                 if lobby:
-                    for player in lobby.players:
-                        if hasattr(player, 'websocket') and player.websocket:  # Check for bot players
-                            # Personalize is_owner for each player
-                            player_response = response.copy()
-                            player_response['is_owner'] = player.id == lobby.owner_id
-                            await self.connection_manager.send_message(player.websocket, player_response)
+                    # Personalize is_owner for each player
+                    await self.connection_manager.send_with_owner_flag(lobby, response)
     
     async def client_handler(self, websocket):
         """Handle new client connections"""
@@ -231,9 +218,9 @@ class GameServer:
         try:
             async for message in websocket:
                 try:
-                    data = json.loads(message)
+                    data = jsonutil.loads(message)
                     await self.handle_message(client_id, websocket, data)
-                except json.JSONDecodeError:
+                except jsonutil.JSONDecodeError:
                     await self.connection_manager.send_message(websocket, {
                         'type': 'error',
                         'message': 'Invalid JSON'
@@ -246,14 +233,25 @@ class GameServer:
     
     async def _schedule_bot_move(self, lobby_code: str):
         """Schedule a bot move after a short delay - DISABLED (frontend bot)"""
-        print(f"[DEBUG] _schedule_bot_move called for lobby {lobby_code} - SKIPPED (frontend bot)")
+        logger.debug("_schedule_bot_move called for lobby %s - SKIPPED (frontend bot)", lobby_code)
         # Bot moves are now handled entirely on the frontend
         return None
     
+    async def _flush_state_periodically(self):
+        """Persist write-behind state (client states, draw offers) to the database"""
+        while True:
+            await asyncio.sleep(self.state_flush_interval)
+            try:
+                self.state.flush_pending_writes()
+            except Exception:
+                # The entries stay dirty; keep the task alive so a later flush can retry
+                logger.exception("[DB] Flushing write-behind state failed")
+
     async def start(self):
         """Start the game server"""
         # Start the timer manager
         timer_task = asyncio.create_task(self.timer_manager.start())
+        flush_task = asyncio.create_task(self._flush_state_periodically())
         
         server = await websockets.serve(self.client_handler, self.host, self.port)
         print(f"Game server started on ws://{self.host}:{self.port}")
@@ -264,11 +262,15 @@ class GameServer:
         finally:
             self.timer_manager.stop()
             timer_task.cancel()
-            try:
-                await timer_task
-            except asyncio.CancelledError:
-                pass
+            flush_task.cancel()
+            for task in (timer_task, flush_task):
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+            self.state.flush_pending_writes()
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     server = GameServer()
     asyncio.run(server.start())
\ No newline at end of file